@@ -2,60 +2,96 @@
 import pandas as pd
 from manual.category_mapping import CatMapping
 import sys
+import os
 
+sys.path.append(os.path.abspath('../..'))
 
-def extract_coords(x):
-    x = x.strip()
-    if x is None:
-        return None
-    try:
-        coords = eval(x.split('\n')[-1])
-    except (NameError, SyntaxError):
-        return None
-    if isinstance(coords, tuple):
-        return coords
-    return None
 
+# raw columns used by the cleaner and their dtypes
+RAW_DTYPES = {'recordId': 'int64', 'callDateTime': 'str', 'priority': 'str', 'description': 'str', 'location': 'str'}
+# "(lat, lon)" on the last line of location
+COORDS_PATTERN = r'\(\s*([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*,\s*([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*\)\s*$'
 
-def main():
-    sys.path.append("../../src")
-    from constants import COL, DateTimeRelated as dtc, PathData
-    print('loading data')
-    path_prefix = 'data/open-baltimore/'
-    df911 = pd.read_csv(PathData.raw_911.replace(path_prefix, ''))
-    # print(df911.head())
-
-    print('preprocessing location and time')
-    df911.location.fillna('NaN', inplace=True)
-    print('extract location')
-    df911[COL.coords] = df911.location.apply(extract_coords)
-    df911[COL.lat] = df911[COL.coords].apply(lambda x: x[0] if x is not None else None)
-    df911[COL.lon] = df911[COL.coords].apply(lambda x: x[1] if x is not None else None)
-    print('parse datetime')
+
+def extract_coords(location):
+    """vectorized (lat, lon) of the last line of location strings
+
+    :param location: pd.Series of str
+    :return: pd.DataFrame, columns: lat, lon, NaN if the last line is not a "(lat, lon)" tuple
+    """
+    last_line = location.fillna('').str.strip().str.split('\n').str[-1]
+    coords = last_line.str.extract(COORDS_PATTERN)
+    coords.columns = ['lat', 'lon']
+    return coords.astype(float)
+
+
+def clean(df911, cmap, verbose=1):
+    """clean raw 911 calls: coordinates from location, DateTime/Date/Time from callDateTime, categories by cmap.
+    Rows without coordinates or with undefined category are dropped.
+
+    :param df911: raw 911 calls, e.g. pd.read_csv(PathData.raw_911)
+    :param cmap: CatMapping of 911 descriptions
+    :return: clean rows sorted by DateTime, the index of df911 is kept
+    """
+    from src.constants import COL
+
+    df911 = df911.copy()
+    if verbose: print('extract location')
+    coords = extract_coords(df911['location'])
+    df911[COL.lat] = coords['lat']
+    df911[COL.lon] = coords['lon']
+    if verbose: print('parse datetime')
     df911[COL.datetime] = pd.to_datetime(df911['callDateTime'], format='%m/%d/%Y %I:%M:%S %p')
-    df911[COL.date] = df911.DateTime.apply(lambda x: x.date())
-    df911[COL.time] = df911.DateTime.apply(lambda x: x.time())
+    df911[COL.date] = df911[COL.datetime].dt.date
+    df911[COL.time] = df911[COL.datetime].dt.time
 
-    print('map categories')
-    cmap = CatMapping('manual/911_categories.csv')
-    df911[cmap.to_col] = cmap.apply_mapping(df911)
+    if verbose: print('map categories')
+    df911[cmap.to_col] = cmap.map_categorical(df911)
     c = df911[~(df911.Longitude.isnull()) & (df911.Category != 'undefined')] \
         [['recordId', COL.datetime, COL.date, COL.time, COL.lat, COL.lon, 'description', 'Category', 'priority']] \
-        .sort_values(COL.datetime)
-
-    # print('split dev/test set')
-    # df911_clean[df911_clean[COL.datetime] < pd.datetime.strptime('2017-01-01', '%Y-%m-%d')]\
-    #     .drop(COL.datetime, axis=1).to_csv('clean/911-dev-set.csv')
-    # df911_clean[df911_clean[COL.datetime] >= pd.datetime.strptime('2017-01-01', '%Y-%m-%d')]\
-    #     .drop(COL.datetime, axis=1).to_csv('clean/911-test-set.csv')
-
-    print('split train/dev/test set')
-    c[(c[COL.datetime] >= dtc.train_sd) & (c[COL.datetime] < dtc.train_ed)].to_csv(
-        PathData.train_911.replace(path_prefix, ''))
-    c[(c[COL.datetime] >= dtc.dev_sd) & (c[COL.datetime] < dtc.dev_ed)].to_csv(
-        PathData.dev_911.replace(path_prefix, ''))
-    c[(c[COL.datetime] >= dtc.test_sd) & (c[COL.datetime] < dtc.test_ed)].to_csv(
-        PathData.test_911.replace(path_prefix, ''))
+        .sort_values(COL.datetime, kind='stable')
+    return c
+
+
+def clean_to_store(raw_path, store, cmap, chunksize=500000, verbose=1):
+    """stream the raw 911 csv in chunks, clean each chunk and append it to the month-partitioned store.
+    Memory is bounded by the chunk size, the index of the raw rows is kept as ori_index.
+
+    :param raw_path: raw 911 csv
+    :param store: EventStore, its months are replaced
+    :param cmap: CatMapping of 911 descriptions
+    :param chunksize: number of raw rows per chunk
+    :return: number of clean rows
+    """
+    import shutil
+    from src.utils.data_prep import to_compact_events
+    from src.utils.dataset_registry import DATASETS
+
+    if os.path.exists(store.path):
+        shutil.rmtree(store.path)
+    n_raw = n_clean = 0
+    reader = pd.read_csv(raw_path, usecols=list(RAW_DTYPES), dtype=RAW_DTYPES, chunksize=chunksize)
+    for i, chunk in enumerate(reader):
+        c = clean(chunk, cmap, verbose=0)
+        if len(c):
+            # the categorical columns are pinned, so that all parts of the store have the same dtypes
+            store.write(to_compact_events(c, categories=DATASETS['911'].categories), mode='append')
+        n_raw += len(chunk)
+        n_clean += len(c)
+        if verbose:
+            print('chunk %d: %d raw rows, %d clean rows so far' % (i, n_raw, n_clean))
+    return n_clean
+
+
+def main():
+    from src.constants import PathData
+    from src.utils.event_store import EventStore
+
+    path_prefix = 'data/open-baltimore/'
+    store = EventStore(PathData.store.replace(path_prefix, ''), '911')
+    print('streaming %s into %s' % (PathData.raw_911, store.path))
+    n = clean_to_store(PathData.raw_911.replace(path_prefix, ''), store, CatMapping('manual/911_categories.csv'))
+    print('%d clean rows, %s' % (n, store))
 
 
 if __name__ == '__main__':
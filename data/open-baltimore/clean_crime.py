@@ -1,83 +1,142 @@
 ﻿# coding=utf-8
+import numpy as np
 import pandas as pd
 from manual.category_mapping import CatMapping
 import sys
 import os
+import shutil
 
 sys.path.append(os.path.abspath('../..'))
 
 
-def main():
-    from src.constants import COL, DateTimeRelated as dtc, PathData
-    from src.utils import reg_check_time_format, reg_check_date_format, can_be_parsed_time
-    path_prefix = 'data/open-baltimore/'
-
-    def pad_time_str(s):
-        if reg_check_time_format(s):
-            return s
+# corrections of raw CrimeTime that don't follow HHMM
+SPECIAL_TIMES = {'1040`': '1040', '0149 01:49': '0149', '12:27': '1227', '1826h': '1826'}
+
+
+def normalize_time(times):
+    """vectorized repair of CrimeTime: HH:MM:SS strings are kept,
+    others (e.g. 1040, 940, 7) are padded to HHMMSS and formatted as HH:MM:SS
+
+    :param times: pd.Series of str
+    :return: (pd.Series of str, pd.Series of bool: the time was not HH:MM:SS)
+    """
+    wrong = ~times.str.match(r'\d{1,2}:\d{1,2}:\d{1,2}')
+    fix = times[wrong].replace(SPECIAL_TIMES)
+    if fix.str.len().isin([5, 6]).any():
+        raise ValueError('len of s=%d' % fix[fix.str.len().isin([5, 6])].str.len().iloc[0])
+    fix = (fix + '00').str.pad(6, side='left', fillchar='0')
+    times = times.copy()
+    times[wrong] = fix.str[:2] + ':' + fix.str[2:4] + ':' + fix.str[4:6]
+    return times, wrong
+
+
+def parse_datetime(dates, times):
+    """vectorized strptime of '%m/%d/%Y' dates and '%H:%M:%S' times, NaT if either can't be parsed.
+    Dates and times repeat a lot: each unique value is parsed once; times are validated by a regex, then added as timedelta
+    """
+    d_codes, d_uniq = pd.factorize(dates)
+    days = pd.to_datetime(pd.Series(d_uniq), format='%m/%d/%Y', errors='coerce').values
+    t_codes, t_uniq = pd.factorize(times)
+    t_uniq = pd.Series(t_uniq)
+    valid = t_uniq.str.fullmatch(r'(?:[01]?\d|2[0-3]):[0-5]?\d:[0-5]?\d').fillna(False).astype(bool)
+    # 3 columns even if no time is valid
+    hms = t_uniq.where(valid).str.split(':', expand=True).reindex(columns=range(3)).astype(float)
+    offset = pd.to_timedelta(hms[0] * 3600 + hms[1] * 60 + hms[2], unit='s').values
+    # code -1: missing date or time
+    days = np.append(days, np.datetime64('NaT'))[d_codes]
+    offset = np.append(offset, np.timedelta64('NaT'))[t_codes]
+    return pd.Series(days + offset, index=dates.index)
+
+
+def clean(c, cmap, reject_dir='remove_from_clean', dedup_key=None, geocoder=None):
+    """clean raw crimes: geocode or drop rows w/o Lat/Lon, drop duplicates, fix time formats, map categories
+
+    :param c: raw crimes, e.g. pd.read_csv(PathData.raw_crime)
+    :param cmap: CatMapping of crime descriptions
+    :param reject_dir: directory of the dropped/corrected rows, None: don't write them
+    :param dedup_key: list of columns identifying a crime, default None (all columns: full-line duplicates)
+    :param geocoder: StreetIndex, rows w/o Lat/Lon get the point of their Location (address), default None
+    :return: clean rows sorted by DateTime, the index of c is kept
+    """
+    from src.constants import COL
+
+    def reject(rows, name):
+        if reject_dir is not None:
+            rows.to_csv(os.path.join(reject_dir, name))
 
-        special_cases = {'1040`': '1040', '0149 01:49': '0149', '12:27': '1227', '1826h': '1826'}
-        if s in special_cases:
-            s = special_cases[s]
-        if len(s) == 5 or len(s) == 6:
-            raise ValueError('len of s=%d' % len(s))
-        s += '00'
-        s = '0' * (6 - len(s)) + s
-        s = s[:2] + ':' + s[2:4] + ':' + s[4:6]
-        return s
-
-    c = pd.read_csv(PathData.raw_crime.replace(path_prefix, ''))
     print('begin cleaning, now # rows = %d' % len(c))
 
+    # geocode rows with incomplete Lat/Lon from their address
+    if geocoder is not None:
+        missing = c.Longitude.isnull() | c.Latitude.isnull()
+        points = geocoder.geocode_latlon(c.loc[missing, 'Location']).dropna()
+        c = c.copy()
+        c.loc[points.index, ['Latitude', 'Longitude']] = points[['Latitude', 'Longitude']].values
+        reject(c.loc[points.index], 'crime_geocoded.csv')
+        print('geocoded %d of %d rows w/o Lat/Lon' % (len(points), missing.sum()))
+
     # remove rows with incomplete Lat/Lon
     cond = ~((c.Longitude.isnull()) | (c.Latitude.isnull()))
-    c[~cond].to_csv('remove_from_clean/crime_no_latlon.csv')
+    reject(c[~cond], 'crime_no_latlon.csv')
     c = c[cond].copy()
     print('dropped rows with incomplete, now # rows = %d ' % (len(c)))
 
-    # There are some full-line duplicates
-    c[c.duplicated()].to_csv('remove_from_clean/crime_duplicates.csv')
-    c = c[~c.duplicated()].copy()
+    # There are some full-line duplicates. Hash the key once, find duplicates on the hashes
+    hashes = pd.util.hash_pandas_object(c if dedup_key is None else c[dedup_key], index=False)
+    dup = hashes.duplicated().values
+    reject(c[dup], 'crime_duplicates.csv')
+    c = c[~dup].copy()
     print('dropped duplicates rows, now # rows = %d ' % (len(c)))
 
     # parse datetime, correct wrong time format
-    c['wrong_time_format'] = c['CrimeTime'].apply(lambda x: not reg_check_time_format(x))
-    c[c['wrong_time_format']].to_csv('remove_from_clean/time_format_issue_get_corrected.csv')
-    c['CrimeTime'] = c['CrimeTime'].apply(pad_time_str)
+    times, c['wrong_time_format'] = normalize_time(c['CrimeTime'].astype(str))
+    reject(c[c['wrong_time_format']], 'time_format_issue_get_corrected.csv')
+    c['CrimeTime'] = times
     print('corrected %d rows with wrong time format ' % (c.wrong_time_format.sum()))
     # time format still unfixed
-    c['can_be_parsed'] = c.CrimeTime.apply(can_be_parsed_time)
-    c[~c['can_be_parsed']].to_csv('remove_from_clean/time_format_issue.csv')
+    datetime = parse_datetime(c['CrimeDate'], c['CrimeTime'])
+    c['can_be_parsed'] = datetime.notnull()
+    reject(c[~c['can_be_parsed']], 'time_format_issue.csv')
     c = c[c['can_be_parsed']].copy()
     print('dropped rows with wrong time format, now # rows = %d ' % (len(c)))
     # get DataTime, Date and Time
-    c[COL.datetime] = c['CrimeDate'] + ' ' + c['CrimeTime']
-    c[COL.datetime] = pd.to_datetime(c[COL.datetime], format='%m/%d/%Y %H:%M:%S')
-    c[COL.date] = c.DateTime.apply(lambda x: x.date())
-    c[COL.time] = c.DateTime.apply(lambda x: x.time())
-    c.sort_values(COL.datetime, inplace=True)
+    c[COL.datetime] = datetime[c.index]
+    c[COL.date] = c[COL.datetime].dt.date
+    c[COL.time] = c[COL.datetime].dt.time
+    c.sort_values(COL.datetime, inplace=True, kind='stable')
 
     print('map categories')
-    cmap = CatMapping('manual/crime_categories.csv')
-    c[cmap.to_col] = cmap.apply_mapping(c)
+    c[cmap.to_col] = cmap.map_categorical(c)
 
     # clean noise
-    c['In/Outside'] = c['Inside/Outside'].apply(
-        lambda x: 'O' if x == 'Outside' else 'I' if x == 'Inside' else x)
+    c['In/Outside'] = c['Inside/Outside'].replace({'Outside': 'O', 'Inside': 'I'})
 
     # drop unused columns
     c.drop(
         ['Location 1', 'Total Incidents', 'Inside/Outside', 'CrimeDate', 'CrimeTime',
          'wrong_time_format', 'can_be_parsed'],
         axis=1, inplace=True)
+    return c
 
-    print('split train/dev/test set')
-    c[(c[COL.datetime] >= dtc.train_sd) & (c[COL.datetime] < dtc.train_ed)].to_csv(
-        PathData.tr_crime.replace(path_prefix, ''))
-    c[(c[COL.datetime] >= dtc.dev_sd) & (c[COL.datetime] < dtc.dev_ed)].to_csv(
-        PathData.de_crime.replace(path_prefix, ''))
-    c[(c[COL.datetime] >= dtc.test_sd) & (c[COL.datetime] < dtc.test_ed)].to_csv(
-        PathData.te_crime.replace(path_prefix, ''))
+
+def main():
+    from src.constants import PathData, PathShape
+    from src.utils.data_prep import to_compact_events
+    from src.utils.dataset_registry import DATASETS
+    from src.utils.event_store import EventStore
+    from src.utils.geocoder import get_street_index
+    path_prefix = 'data/open-baltimore/'
+
+    c = pd.read_csv(PathData.raw_crime.replace(path_prefix, ''))
+    # without the street centerlines, rows w/o Lat/Lon are dropped
+    geocoder = get_street_index(PathShape.centerline.replace(path_prefix, ''))
+    c = clean(c, CatMapping('manual/crime_categories.csv'), geocoder=geocoder)
+
+    print('writing clean crimes into the month-partitioned event store')
+    store = EventStore(PathData.store.replace(path_prefix, ''), 'crime')
+    if os.path.exists(store.path):
+        shutil.rmtree(store.path)
+    store.write(to_compact_events(c, categories=DATASETS['crime'].categories), mode='append', verbose=1)
 
     return
 
@@ -0,0 +1,183 @@
+# coding=utf-8
+"""Append new raw rows of 911 calls or crimes to the EventStore, without re-cleaning the history
+
+usage (from data/open-baltimore/, like clean_911.py and clean_crime.py):
+
+    python ingest.py 911 raw/new_911_calls.csv
+    python ingest.py crime raw/new_crimes.csv
+
+The raw file may hold only the new rows or the full export. Rows already ingested are skipped:
+911 calls by a high-water mark of recordId kept in <store>/<dname>/_ingest.json;
+crimes (no monotonic id in the raw data, late reports carry earlier dates) by the hash of their DateTime and
+raw columns, against the crimes in the store.
+The store must exist (built by clean_911.py / clean_crime.py or src/utils/event_store.py), it holds the history.
+"""
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath('../..'))
+
+CAT_MAPPINGS = {'911': 'manual/911_categories.csv', 'crime': 'manual/crime_categories.csv'}
+
+
+def get_state_path(store):
+    return os.path.join(store.path, '_ingest.json')
+
+
+def load_state(store):
+    """high-water marks of the store: next ori_index and max recordId (911)"""
+    if not store.exists():
+        raise ValueError('no event store at %s: build it from the history first (python clean_%s.py, '
+                         'or python -m src.utils.event_store %s from the repo root)'
+                         % (store.path, store.dname, store.dname))
+    path = get_state_path(store)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+
+    # first ingest into a store built from the history: derive the marks from the data
+    state = {'next_ori_index': max_ori_index(store) + 1, 'max_record_id': None}
+    if store.dname == '911':
+        state['max_record_id'] = int(store.read(columns=['recordId'])['recordId'].max())
+    return state
+
+
+def max_ori_index(store):
+    """largest ori_index in use: in the store, the clean csv and the spu assignment files of the dataset"""
+    from src.constants import COL, PathData
+    from src.e0_load_tr_de_spu import get_assignment_path
+
+    marks = [int(store.read(columns=[COL.ori_index])[COL.ori_index].max())]
+    # the clean csv and the assignment files are indexed by ori_index, paths are relative to the repo root
+    paths = [os.path.join('../..', PathData.as_dict[split][store.dname])
+             for split in ('train', 'dev', 'test') if store.dname in PathData.as_dict[split]]
+    paths += glob.glob(os.path.join('../..', get_assignment_path(store.dname + '-*')))
+    for path in paths:
+        if os.path.exists(path):
+            index = pd.read_csv(path, usecols=[0]).iloc[:, 0]
+            if len(index):
+                marks.append(int(index.max()))
+    return max(marks)
+
+
+def save_state(store, state):
+    os.makedirs(store.path, exist_ok=True)
+    with open(get_state_path(store), 'w') as f:
+        json.dump(state, f)
+
+
+def _key_values(column):
+    """values of a key column comparable between the raw csv and the store:
+    numbers as float (the store downcasts integers), anything else as str"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+    numbers = pd.to_numeric(column, errors='coerce')
+    if numbers.notnull().sum() == column.notnull().sum():
+        return numbers.astype(float)
+    return column.astype(str)
+
+
+def crime_keys(datetime, data, columns):
+    """uint64 hash of DateTime and columns of each row"""
+    from src.utils.event_cube import to_ns
+
+    key = pd.DataFrame({c: _key_values(data[c]) for c in columns}, index=data.index)
+    key['DateTime'] = to_ns(datetime)
+    return pd.util.hash_pandas_object(key, index=False).values
+
+
+def new_crime_rows(raw, store):
+    """raw crimes not in the store yet, by the hash of (DateTime, raw columns kept in the store)"""
+    import clean_crime
+
+    times, _ = clean_crime.normalize_time(raw['CrimeTime'].astype(str))
+    datetime = clean_crime.parse_datetime(raw['CrimeDate'], times)
+    ingested = store.read()
+    # Latitude/Longitude are projected to X/Y in the store, the other raw columns are kept as they are
+    columns = [c for c in raw.columns if c in ingested.columns]
+    seen = crime_keys(ingested.index, ingested, columns)
+    keep = ~np.isin(crime_keys(datetime, raw, columns), seen)
+    return raw[keep]
+
+
+def clean_new_rows(dname, raw, store, state):
+    """clean the raw rows not ingested yet, the others are dropped before cleaning"""
+    from manual.category_mapping import CatMapping
+
+    cmap = CatMapping(CAT_MAPPINGS[dname])
+    if dname == '911':
+        import clean_911
+        if state['max_record_id'] is not None:
+            raw = raw[raw['recordId'] > state['max_record_id']]
+        return clean_911.clean(raw, cmap, verbose=0)
+
+    import clean_crime
+    raw = new_crime_rows(raw, store)
+    if len(raw) == 0:
+        return raw
+    return clean_crime.clean(raw, cmap, reject_dir=None)
+
+
+def ingest(dname, raw_path, verbose=1):
+    """clean the new rows of raw_path, append them to the store and assign spus to them
+
+    :param dname: 911 or crime
+    :param raw_path: raw csv, in the format of PathData.raw_911 / raw_crime
+    :return: the new events in the compact event schema
+    """
+    from src.constants import COL, PathData
+    from src.e0_load_tr_de_spu import append_assignment
+    from src.utils.data_prep import to_compact_events
+    from src.utils.dataset_registry import DATASETS
+    from src.utils.event_store import EventStore
+
+    start = time.time()
+    store = EventStore(os.path.join('../..', PathData.store), dname)
+    state = load_state(store)
+
+    raw = pd.read_csv(raw_path)
+    clean = clean_new_rows(dname, raw, store, state)
+    if len(clean) == 0:
+        if verbose:
+            print('no new rows in %s' % raw_path)
+        return clean
+
+    # ori_index of new rows continues the index of the store, the row numbers of raw_path would collide with it
+    clean.index = pd.RangeIndex(state['next_ori_index'], state['next_ori_index'] + len(clean))
+    # the categorical columns of the dataset, so that appended partitions have the same dtypes as the history
+    events = to_compact_events(clean, categories=DATASETS[dname].categories)
+    store.write(events, mode='append', verbose=verbose)
+
+    # assignment files are relative to the repo root
+    cwd = os.getcwd()
+    os.chdir('../..')
+    try:
+        append_assignment(dname, events, verbose=verbose)
+    finally:
+        os.chdir(cwd)
+
+    state['next_ori_index'] = int(events[COL.ori_index].max()) + 1
+    if 'recordId' in events.columns:
+        state['max_record_id'] = max(int(events['recordId'].max()), state['max_record_id'] or 0)
+    save_state(store, state)
+    if verbose:
+        print('ingested %d new %s events in %.1fs, EventCubes pick them up at the next load'
+              % (len(events), dname, time.time() - start))
+    return events
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] not in CAT_MAPPINGS:
+        print(__doc__)
+        sys.exit(1)
+    ingest(sys.argv[1], sys.argv[2])
+
+
+if __name__ == '__main__':
+    main()
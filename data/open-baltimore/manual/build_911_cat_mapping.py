@@ -1,4 +1,7 @@
 # coding=utf-8
+from collections import Counter
+
+import numpy as np
 import pandas as pd
 
 
@@ -14,6 +17,85 @@ def similarity(a, b):
     return match_size / shorter_size
 
 
+class CandidateIndex:
+    """Inverted index of the characters of the candidates, for matching descriptions to candidates by similarity()
+
+    The matching blocks of difflib are a common subsequence of the two strings, so their size is at most
+    the overlap of the character counts. overlap / len(shorter) is an upper bound of similarity(),
+    computed for all candidates at once from the postings of the characters of a description.
+    Candidates are then checked in decreasing bound, and the search stops once the bound can't beat the best match.
+    """
+
+    def __init__(self, candidates):
+        self.candidates = list(candidates)
+        self.lengths = np.array([len(c) for c in self.candidates], dtype=float)
+        postings = {}
+        for i, can in enumerate(self.candidates):
+            for ch, n in Counter(can.lower()).items():
+                postings.setdefault(ch, []).append((i, n))
+        # char -> (candidate ids, counts of the char in the candidates)
+        self.postings = {ch: (np.array([i for i, _ in p]), np.array([n for _, n in p])) for ch, p in postings.items()}
+
+    def upper_bounds(self, text):
+        """upper bounds of similarity(candidate, text) of all candidates"""
+        overlap = np.zeros(len(self.candidates))
+        for ch, n in Counter(text.lower()).items():
+            if ch in self.postings:
+                ids, cnts = self.postings[ch]
+                overlap[ids] += np.minimum(cnts, n)
+        return overlap / np.maximum(np.minimum(self.lengths, len(text)), 1)
+
+    def best_match(self, text, threshold):
+        """the candidate with the max similarity to text, if the max is > threshold; ties go to the first candidate.
+
+        :return: (max similarity, candidate), (-1, None) if no candidate is above threshold
+        """
+        if len(text) == 0:
+            return -1, None
+        bounds = self.upper_bounds(text)
+        # shortlist: candidates that may be above threshold, by decreasing bound, then by order of candidates
+        shortlist = np.flatnonzero(bounds > threshold)
+        shortlist = shortlist[np.lexsort((shortlist, -bounds[shortlist]))]
+        best, best_id = -1, None
+        for i in shortlist:
+            if bounds[i] < best:
+                break
+            simi = similarity(self.candidates[i], text)
+            if simi > best or (simi == best and i < best_id):
+                best, best_id = simi, i
+        if best <= threshold:
+            return -1, None
+        return best, self.candidates[best_id]
+
+
+def _best_matches(candidates, descriptions, threshold):
+    index = CandidateIndex(candidates)
+    return [index.best_match(d, threshold) for d in descriptions]
+
+
+def match_candidates(descriptions, candidates, threshold=0.84, n_jobs=None, chunksize=200):
+    """match each description to the candidate of max similarity, keeping the matches above threshold.
+    Same matches as computing similarity() of all pairs, the descriptions are matched in parallel.
+
+    :param descriptions: list of clean descriptions
+    :param candidates: list of candidates
+    :param threshold: min similarity (exclusive) of a match
+    :param n_jobs: number of processes, default None (#cpu); 1: in this process
+    :param chunksize: number of descriptions per task
+    :return: pd.DataFrame, index: matched descriptions, columns: max_simi, arg_max (the matched candidate)
+    """
+    descriptions = list(descriptions)
+    chunks = [descriptions[i:i + chunksize] for i in range(0, len(descriptions), chunksize)]
+    if n_jobs == 1:
+        results = [_best_matches(candidates, chunk, threshold) for chunk in chunks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(n_jobs) as pool:
+            results = list(pool.map(_best_matches, [candidates] * len(chunks), chunks, [threshold] * len(chunks)))
+    matches = pd.DataFrame([m for r in results for m in r], index=descriptions, columns=['max_simi', 'arg_max'])
+    return matches[matches.max_simi > threshold]
+
+
 # field interview: https://bizfluent.com/info-8223154-field-interview.html
 # false pretense: Under federal law, obtaining money or property through false pretenses as part of a scheme or artifice to defraud, and using means of interstate commerce such as a telephone, is illegal....
 # aed nonbreathing: An automated external defibrillator (AED) is a portable electronic device that automatically diagnoses the life-threatening cardiac arrhythmias of ventricular fibrillation and pulseless ventricular tachycardia,
@@ -114,22 +196,15 @@ def main():
     raw2clean = {row.description: row.description_clean for _, row in df911.drop_duplicates('description').iterrows()}
 
     # get des_clean with > 5 records and not in DROP/TBD types
-    description = df911.description_clean.value_counts().to_frame()
-    description['percentage'] = description.description_clean / description.description_clean.sum()
-    des_clean1 = description[description.description_clean > 5].drop(DROP_IRRELEVANT + TBD_IRRELEVANT).reset_index()
+    description = df911.description_clean.value_counts().rename_axis('description_clean').reset_index(name='count')
+    description['percentage'] = description['count'] / description['count'].sum()
+    des_clean1 = description[description['count'] > 5].set_index('description_clean')
+    des_clean1 = des_clean1.drop(DROP_IRRELEVANT + TBD_IRRELEVANT).reset_index()
     # get candidates with >1000 records
-    candidates = des_clean1[des_clean1.description_clean > 1000]['index'].tolist()
-
-    # compute string similarity between each candidate and each description in des_clean1
-    for can in candidates:
-        #     print(can)
-        des_clean1[can] = des_clean1['index'].apply(lambda x: similarity(can, x))
+    candidates = des_clean1[des_clean1['count'] > 1000]['description_clean'].tolist()
 
     # argmax similarity as the matched candidate for noise description
-    des_clean1['max_simi'] = des_clean1[candidates].max(axis=1)
-    des_clean1['arg_max'] = des_clean1[candidates].apply(lambda x: x.argmax(), axis=1)
-    des_clean1.set_index('index', inplace=True)
-    des_clean1 = des_clean1[des_clean1.max_simi > 0.84].copy()
+    des_clean1 = match_candidates(des_clean1['description_clean'], candidates, threshold=0.84)
 
     # the similarity result is not perfect, manually inspect and find wrong match
     for k, v in WRONG_MATCH.items():
@@ -142,7 +217,7 @@ def main():
 
     # map clean description to category
     des_clean1['Category'] = des_clean1.arg_max.apply(lambda x: CANDIDATE2CATEGORY[x])
-    clean2category = {clean: category for clean, category in des_clean1.Category.iteritems()}
+    clean2category = {clean: category for clean, category in des_clean1.Category.items()}
 
     # get final mapping, drop undefined category
     raw2category = {raw: clean2category.get(clean, 'undefined') for raw, clean in raw2clean.items()}
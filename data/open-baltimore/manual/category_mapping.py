@@ -1,6 +1,27 @@
 # coding=utf-8
+import os
+
+import numpy as np
 import pandas as pd
 
+UNDEFINED = 'undefined'
+# mapping files of crime and 911, their categories together are the category set of both datasets
+MAPPING_FILES = ('crime_categories.csv', '911_categories.csv')
+
+
+def shared_categories(paths=None):
+    """the fixed category set shared across crime and 911: sorted categories of the mapping files, plus 'undefined'
+
+    :param paths: list of mapping files, default None (MAPPING_FILES, next to this module)
+    :return: pd.Index
+    """
+    if paths is None:
+        paths = [os.path.join(os.path.dirname(os.path.abspath(__file__)), f) for f in MAPPING_FILES]
+    categories = {UNDEFINED}
+    for path in paths:
+        categories.update(pd.read_csv(path).iloc[:, 0].dropna().str.strip())
+    return pd.Index(sorted(categories))
+
 
 class CatMapping:
     def __init__(self, path, verbose=0):
@@ -17,11 +38,11 @@ class CatMapping:
         if mapping.shape[1] != 2:
             raise ValueError('mapping file should have and only have 2 columns')
 
-        mapping.fillna(method='ffill', inplace=True)
+        mapping = mapping.ffill()
         self.to_col = mapping.columns[0]
         self.from_col = mapping.columns[1]
         self.mapping = mapping
-        self.mapping_dict = {x[1].strip(): x[0].strip() for _, x in mapping.iterrows()}
+        self.mapping_dict = {frm.strip(): to.strip() for to, frm in mapping.itertuples(index=False)}
 
         if verbose > 0:
             print('mapping raw types in column %s to categories in column %s' % (self.from_col, self.to_col))
@@ -39,16 +60,42 @@ class CatMapping:
         if isinstance(obj, pd.Series):
             if self.verbose > 0:
                 print('obj is pd.Series')
-            return obj.apply(self.apply_mapping)
+            return pd.Series(np.asarray(self.map_categorical(obj, self.own_categories()), dtype=object),
+                             index=obj.index, name=obj.name)
 
         if isinstance(obj, pd.DataFrame):
             if self.verbose > 0:
                 print('obj is pd.DataFrame')
-            return obj[self.from_col].apply(self.apply_mapping)
+            return self.apply_mapping(obj[self.from_col])
 
         if self.verbose > 1:
             print('obj is %s' % type(obj))
-        return self.mapping_dict.get(obj, 'undefined')
+        return self.mapping_dict.get(obj, UNDEFINED)
+
+    def own_categories(self):
+        """sorted categories of this mapping file, plus 'undefined'"""
+        return pd.Index(sorted(set(self.mapping_dict.values()) | {UNDEFINED}))
+
+    def map_categorical(self, obj, categories=None):
+        """vectorized apply_mapping: the raw types are factorized once and only the unique ones are looked up
+
+        :param obj: pd.Series of raw types, or pd.DataFrame with column self.from_col
+        :param categories: category set of the result, default None (shared_categories(), same for crime and 911)
+        :return: pd.Categorical, 'undefined' for raw types not in the mapping
+        """
+        if isinstance(obj, pd.DataFrame):
+            obj = obj[self.from_col]
+        categories = shared_categories() if categories is None else pd.Index(categories)
+
+        codes, uniques = pd.factorize(obj)
+        mapped = [self.mapping_dict.get(raw, UNDEFINED) for raw in uniques]
+        unique_codes = categories.get_indexer(mapped)
+        if (unique_codes < 0).any():
+            raise ValueError('categories not in the category set: %s'
+                             % sorted({m for m, u in zip(mapped, unique_codes) if u < 0}))
+        # code -1 of factorize: missing raw type
+        unique_codes = np.append(unique_codes, categories.get_loc(UNDEFINED))
+        return pd.Categorical.from_codes(unique_codes[codes], categories)
 
 
 def main():
@@ -61,6 +108,7 @@ def main():
     print(df[cmap.from_col].apply(cmap.apply_mapping))
     print(cmap.apply_mapping(df[cmap.from_col]))
     print(cmap.apply_mapping(df))
+    print(cmap.map_categorical(df))
     return
 
 
@@ -12,7 +12,7 @@ from src.exp_helper import *
 from src.model.bsln_bower import Bower
 from src.model.bsln_kde import KDE
 from src.utils.metric_single_num import hit_rate, search_efficient_rate, prediction_accuracy_index
-from src.utils.spatial_unit import grid2nbh
+from src.utils.spatial_unit import grid2nbh, get_grid_spec
 
 grid_size = 50
 train_tw = 60
@@ -51,13 +51,15 @@ evaluators = [hit_rate, search_efficient_rate, prediction_accuracy_index]
 
 def get_pred(compile_data, train_roller, eval_roller, kde, bower, refit=False,
              x_setting='time_indexed_points', y_setting='event_cnt', verbose=0, debug=False):
-    grid_centers = compile_data.spu.Cen_coords.apply(lambda x: eval(x))
+    centers = get_grid_spec(compile_data.spu_name).centers().tolist()
+    grid_centers = pd.Series(list(map(tuple, centers)), index=compile_data.spu.index)
 
     tmp_train_roller = copy.copy(train_roller)
 
     pred_res = defaultdict(dict)
 
-    for i, dates in enumerate(eval_roller.roll()):
+    plan = compile_data.compile_plan(eval_roller)
+    for i, dates in enumerate(plan.dates):
         past_sd, past_ed, pred_sd, pred_ed = dates
         period = 'X: %s~%s -> Y: %s~%s' % (past_sd, past_ed, pred_sd, pred_ed)
 
@@ -75,7 +77,7 @@ def get_pred(compile_data, train_roller, eval_roller, kde, bower, refit=False,
         #     if verbose > 1:
         #         print('model fit')
 
-        eval_x, eval_y = data_for_fit(compile_data, x_setting=x_setting, y_setting=y_setting, dates=dates,
+        eval_x, eval_y = data_for_fit(compile_data, x_setting=x_setting, y_setting=y_setting, plan=plan, period=i,
                                       verbose=verbose)
 
         pred_res[period]['true_y'] = eval_y
@@ -120,15 +122,10 @@ def bnia_stats(pred_res, data, xday):
     sum_risk = lambda x: x
     for name, stats_func in [('above_mean', above_mean), ('top20', top20), ('above_mean_std', above_mean_std),
                              ('sum_risk', sum_risk)]:
-        res = []
-        for idx, row in pred_res.iterrows():
-            kde_stats = stats_func(row.kde200)
-            kde_stats = pd.Series(kde_stats, index=data.spu.index, name='stat')
-            kde_stats = grid2nbh(kde_stats).values.tolist()
-            bower_stats = stats_func(row.bower)
-            bower_stats = pd.Series(bower_stats, index=data.spu.index, name='stat')
-            bower_stats = grid2nbh(bower_stats).tolist()
-            res.append({'period': idx, 'kde200': kde_stats, 'bower': bower_stats})
+        # periods x grids -> periods x nbh in one sparse matrix multiply
+        kde_stats = grid2nbh(np.vstack([stats_func(x) for x in pred_res.kde200]))
+        bower_stats = grid2nbh(np.vstack([stats_func(x) for x in pred_res.bower]))
+        res = {'period': pred_res.index, 'kde200': kde_stats.values.tolist(), 'bower': bower_stats.values.tolist()}
         res = pd.DataFrame(res).set_index('period')
         res.to_csv('exp_res/bower_%dday_bnia_%s_hotspots.csv' % (xday, name))
 
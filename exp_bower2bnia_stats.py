@@ -36,24 +36,20 @@ def bnia_fpn(data, ys, bower, kde200, xday=2, save_file=True):
         for fname in ['fp', 'fn', 'tp'][2:]:
             print(f"working on {xday}day, hotspot:{hname}, {fname}")
             fpn_res = {}
-            for p in ys.columns:
-                p_fpn_res = {}
-                for mname, model in [('bower', bower), ('kde200', kde200)]:
-                    h = hfunc(model[p])  # is hotspot or not
-                    y = ys[p].astype(bool)  # has crime or not
-                    if fname == 'fp':
-                        fpn = (h & ~y)
-                    elif fname == 'fn':
-                        fpn = (~h & y)
-                    else:
-                        fpn = (h & y)
-                    # fpn = (h & ~y) if fname == 'fp' else (~h & y)
-                    fpn = pd.Series(fpn, index=data.spu.index, name='stat')
-                    fpn = grid2nbh(fpn).values.tolist()
-                    p_fpn_res['%s' % (mname)] = fpn
-                fpn_res[p] = p_fpn_res
+            y = ys.astype(bool)  # has crime or not, grids x periods
+            for mname, model in [('bower', bower), ('kde200', kde200)]:
+                h = model[ys.columns].apply(hfunc)  # is hotspot or not
+                if fname == 'fp':
+                    fpn = (h & ~y)
+                elif fname == 'fn':
+                    fpn = (~h & y)
+                else:
+                    fpn = (h & y)
+                # periods x grids -> periods x nbh in one sparse matrix multiply
+                fpn_res[mname] = grid2nbh(fpn.T).values.tolist()
+            fpn_res = pd.DataFrame(fpn_res, index=ys.columns)
             if save_file:
-                pd.DataFrame.from_dict(fpn_res, 'index').to_csv(
+                fpn_res.to_csv(
                     'exp_res/bower_%dday_bnia_%s_hotspots_%s.csv' % (xday, hname, fname))
 
 
@@ -21,6 +21,7 @@ class COL:
         - lat: Latitude
         - lon: Longitude
         - coords: coordinate of points, (lon, lat) or (X, Y) in other CRS
+        - x, y: coordinate of points in the projected CRS, as two float columns
         - center: the coordinate of the center of a geometry object
         - area: the area of the unit, in m^2
     """
@@ -42,6 +43,8 @@ class COL:
     lat = 'Latitude'
     lon = 'Longitude'
     coords = 'Coords'
+    x = 'X'
+    y = 'Y'
     center = 'Cen_coords'
     area = 'Area'
     spu = 'SPU'
@@ -55,6 +58,8 @@ class PathData:
     ----------
     crime: part 1 victim based crime
     911: 911 data
+    arrest, gun_offender: BPD arrests and gun offenders, raw only
+    store: root of the month-partitioned EventStore of the clean data
     """
     # crime
     raw_crime = 'data/open-baltimore/raw/BPD_Part_1_Victim_Based_Crime_Data.csv'
@@ -66,6 +71,11 @@ class PathData:
     tr_911 = 'data/open-baltimore/clean/train-911.csv'
     de_911 = 'data/open-baltimore/clean/dev-911.csv'
     te_911 = 'data/open-baltimore/clean/test-911.csv'
+    # arrests and gun offenders, cleaned into the store by src.utils.dataset_registry
+    raw_arrest = 'data/open-baltimore/raw/BPD_Arrests.csv'
+    raw_gun_offender = 'data/open-baltimore/raw/Gun_Offenders.csv'
+    # month-partitioned clean events, see src.utils.event_store
+    store = 'data/open-baltimore/store/'
 
     as_dict = {
         'train': {
@@ -90,8 +100,10 @@ class PathShape:
     Attributes
     ----------
     cityline: the cityline of Baltimore
+    centerline: street centerlines of Baltimore with address ranges, for the offline geocoder
     """
     cityline = 'data/open-baltimore/raw/Baltcity_Line/baltcity_line.shp'
+    centerline = 'data/open-baltimore/raw/Street_Centerlines/street_centerlines.shp'
     spu_dir = 'data/spu/'
 
 
@@ -1,10 +1,13 @@
 import os
+from functools import partial
 
-import geopandas as gp
 import pandas as pd
 
 from src.constants import PathData, PathShape, COL
-from src.utils.data_prep import prep_911, prep_crime
+from src.utils.data_prep import prep_clean_events, concat_events, memory_report, events_to_gdf
+from src.utils.dataset_registry import DATASETS
+from src.utils.event_store import EventStore
+from src.utils.spu_registry import SpuRegistry
 
 
 def add_spu_to_data(spu_name, dname, train, dev, verbose):
@@ -14,31 +17,55 @@ def add_spu_to_data(spu_name, dname, train, dev, verbose):
     train = train.reset_index().merge(spu_train, how='left').set_index(COL.datetime)
     spu_dev = assigning_spu(spu_name, dname + '-dev', dev, verbose)
     dev = dev.reset_index().merge(spu_dev, how='left').set_index(COL.datetime)
+    # the left merge gives float spu with NaN for events outside of any spu
+    train[COL.spu] = train[COL.spu].astype('Int32')
+    dev[COL.spu] = dev[COL.spu].astype('Int32')
     return train, dev
 
 
-def load_911(spu_name=None, verbose=0, merge_tr_de=False):
-    train = prep_911(PathData.tr_911, by_category=False, coords_series=False, gpdf=True)
-    dev = prep_911(PathData.de_911, by_category=False, coords_series=False, gpdf=True)
-    if spu_name is not None:
-        train, dev = add_spu_to_data(spu_name, '911', train, dev, verbose)
-    if merge_tr_de:
-        return train.append(dev)
-    return train, dev
+def read_clean_events(dname, split, geometry=False, verbose=0):
+    """compact events of a split (train, dev, test) from the EventStore of dname.
+    Without a store, datasets cleaned by a script are read from their clean csv,
+    the other registered datasets get their store built from the raw csv once (see DatasetSource)"""
+    store = EventStore(PathData.store, dname)
+    if not store.exists():
+        if DATASETS[dname].clean_script is not None:
+            return prep_clean_events(PathData.as_dict[split][dname], geometry=geometry, verbose=verbose)
+        store = DATASETS[dname].build_store(PathData.store, verbose=verbose)
+    if verbose > 0:
+        print('reading %s events of %s' % (split, store))
+    data = store.read(split=split)
+    return events_to_gdf(data) if geometry else data
 
 
-def load_crime(spu_name=None, verbose=0, merge_tr_de=False):
-    train = prep_crime(PathData.tr_crime, by_category=False, coords_series=False, gpdf=True)
-    dev = prep_crime(PathData.de_crime, by_category=False, coords_series=False, gpdf=True)
+def load_events(dname, spu_name=None, verbose=0, merge_tr_de=False, geometry=False):
+    """events of a registered dataset in the compact event schema (see prep_clean_events), geometry only if requested
+
+    :param dname: name of the dataset in DATASETS
+    :param spu_name: name of the spu to assign the events to, default None (no spu)
+    :param merge_tr_de: return one table of train and dev instead of (train, dev)
+    """
+    train = read_clean_events(dname, 'train', geometry=geometry, verbose=verbose)
+    dev = read_clean_events(dname, 'dev', geometry=geometry, verbose=verbose)
     if spu_name is not None:
-        train, dev = add_spu_to_data(spu_name, 'crime', train, dev, verbose)
+        train, dev = add_spu_to_data(spu_name, dname, train, dev, verbose)
     if merge_tr_de:
-        data = train.append(dev)
-        return data
+        return concat_events([train, dev])
     return train, dev
 
 
-LOAD_FUNCS = {'crime': load_crime, '911': load_911}
+def load_911(spu_name=None, verbose=0, merge_tr_de=False, geometry=False):
+    """911 data in the compact event schema (see prep_clean_events), geometry only if requested"""
+    return load_events('911', spu_name, verbose, merge_tr_de, geometry)
+
+
+def load_crime(spu_name=None, verbose=0, merge_tr_de=False, geometry=False):
+    """crime data in the compact event schema (see prep_clean_events), geometry only if requested"""
+    return load_events('crime', spu_name, verbose, merge_tr_de, geometry)
+
+
+# dname -> loading function, one per dataset of the registry
+LOAD_FUNCS = {dname: partial(load_events, dname) for dname in DATASETS}
 
 
 def get_spu_path(name):
@@ -46,22 +73,40 @@ def get_spu_path(name):
 
 
 def get_spu(name):
-    return gp.read_file(get_spu_path(name))
+    """spu by name, cached in process and in a binary file next to the geojson, see SpuRegistry"""
+    return SPU_REGISTRY.get(name)
+
+
+SPU_REGISTRY = SpuRegistry(get_spu_path)
+
+
+def get_grid_spec_path(name):
+    return PathShape.spu_dir + name + '.grid.json'
+
+
+def get_hex_spec_path(name):
+    return PathShape.spu_dir + name + '.hex.json'
 
 
 def get_assignment_path(dname):
     return PathShape.spu_dir + 'assignment_%s.csv' % dname
 
 
-def assigning_spu(spu_name, dname, data, verbose=0):
-    # running the code below would change the index name of data
-    # create a copy to avoid that
-    data = data[[COL.ori_index, 'geometry']].copy()
+def has_assignment(spu_name, dname, splits=('train', 'dev')):
+    """whether the assignment files of the splits of dname already have spu_name, i.e. assigning is reading a csv"""
+    for split in splits:
+        apath = get_assignment_path('%s-%s' % (dname, split))
+        if not os.path.exists(apath) or spu_name not in pd.read_csv(apath, index_col=0, nrows=0).columns:
+            return False
+    return True
 
+
+def assigning_spu(spu_name, dname, data, verbose=0):
     # Get existing assignment
     apath = get_assignment_path(dname)
     if os.path.exists(apath):
-        assignment = pd.read_csv(apath, index_col=0)
+        # the ori_index of an empty split (a header-only file) would be read as object
+        assignment = pd.read_csv(apath, index_col=0, dtype={COL.ori_index: data[COL.ori_index].dtype})
     else:
         # not exist, create an empty assignment with index=data[ori_index]
         if verbose:
@@ -75,10 +120,7 @@ def assigning_spu(spu_name, dname, data, verbose=0):
     else:
         print(
             'spatial unit assignment for data %s in spu %s does not exist, spatial intersecting...' % (dname, spu_name))
-        spu = get_spu(spu_name)
-        joined = gp.sjoin(spu, data)[[COL.ori_index]]
-        joined = joined.reset_index().rename(columns={'index': spu_name}).set_index(COL.ori_index)
-        assignment = assignment.join(joined, how='left')
+        assignment = assignment.join(spu_join(spu_name, data), how='left')
         assignment.to_csv(apath)
 
     spu_assign = assignment[spu_name].reset_index().drop_duplicates()
@@ -93,6 +135,84 @@ def assigning_spu(spu_name, dname, data, verbose=0):
     return spu_assign
 
 
+def spu_join(spu_name, data):
+    """every spu each event intersects, an event on a border of spus gets one row per spu.
+    The rule of both the full assignment (assigning_spu) and the incremental one (append_assignment)
+
+    :param spu_name: name of the spatial unit, e.g. grid_1000, bnia_nbh
+    :param data: events with COL.ori_index and either a geometry or COL.x, COL.y in the crs of the spu
+    :return: pd.DataFrame indexed by COL.ori_index with the spu index in column spu_name, events in no spu are left out
+    """
+    import geopandas as gp
+
+    # running the code below would change the index name of data
+    # create a copy to avoid that. Compact event tables have no geometry, build points from x/y
+    if 'geometry' in data.columns:
+        data = data[[COL.ori_index, 'geometry']].copy()
+    else:
+        data = gp.GeoDataFrame(data[[COL.ori_index]].copy(), geometry=gp.points_from_xy(data[COL.x], data[COL.y]))
+    spu = get_spu(spu_name)
+    if data.crs is None:
+        # x/y are in the crs of the spatial units
+        data = data.set_crs(spu.crs)
+    joined = gp.sjoin(spu, data)[[COL.ori_index]]
+    return joined.reset_index().rename(columns={'index': spu_name}).set_index(COL.ori_index)
+
+
+def append_assignment(dname, data, verbose=0):
+    """assign spus to new events only, appending them to the assignment file of the split they fall in
+    (assignment_<dname>-<split>.csv), for every spu that already has an assignment of dname
+
+    :param dname: name of the dataset, e.g. crime, 911
+    :param data: new events in the compact event schema, with COL.ori_index, COL.x, COL.y
+    :return: list of the spu names assigned
+    """
+    import glob
+    import numpy as np
+    from src.utils.event_store import split_of
+
+    # spu names assigned in any split of the data set
+    spu_names = set()
+    for apath in glob.glob(get_assignment_path(dname + '-*')):
+        spu_names |= set(pd.read_csv(apath, index_col=0, nrows=0).columns)
+    spu_names = sorted(spu_names)
+    if not spu_names:
+        return spu_names
+
+    joined = {spu_name: spu_join(spu_name, data) for spu_name in spu_names}
+
+    splits = split_of(data.index)
+    for split in np.unique(splits):
+        apath = get_assignment_path('%s-%s' % (dname, split))
+        exists = os.path.exists(apath)
+        # keep the column order of the existing file, joining in that order gives the rows assigning_spu would write
+        columns = list(pd.read_csv(apath, index_col=0, nrows=0).columns) if exists else spu_names
+        rows = pd.DataFrame(index=pd.Index(data[COL.ori_index].values[splits == split], name=COL.ori_index))
+        for spu_name in columns:
+            rows = rows.join(joined[spu_name], how='left')
+        rows.to_csv(apath, mode='a' if exists else 'w', header=not exists)
+        if verbose:
+            print('appended %d spu assignments to %s' % (len(rows), apath))
+    return spu_names
+
+
+def compare_memory(spu_name='grid_1000'):
+    """memory report of the legacy (object columns + geometry) and the compact schema of each dataset"""
+    from src.utils.data_prep import prep_clean_point_data
+
+    frames = {}
+    # datasets with a legacy clean csv
+    for dname in PathData.as_dict['train']:
+        func = LOAD_FUNCS[dname]
+        tr, de = PathData.as_dict['train'][dname], PathData.as_dict['dev'][dname]
+        legacy = [prep_clean_point_data(path, by_category=False, coords_series=False, gpdf=True) for path in (tr, de)]
+        frames[dname + '-legacy'] = pd.concat(legacy)
+        frames[dname + '-compact'] = func(spu_name, merge_tr_de=True)
+    report = memory_report(frames)
+    print(report)
+    return report
+
+
 def main():
     return
 
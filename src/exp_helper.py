@@ -1,13 +1,16 @@
 import copy
+import time
 from itertools import chain
 
 import pandas as pd
 
-from src.constants import COL
-from src.e0_load_tr_de_spu import LOAD_FUNCS, get_spu
-from src.utils import get_df_categories, subdf_by_categories
+from src.e0_load_tr_de_spu import LOAD_FUNCS, get_spu, add_spu_to_data, has_assignment
+from src.utils.data_prep import concat_events
+from src.utils.event_cube import EventCube, to_ns
+from src.utils.event_view import EventTable, EventView
+from src.utils.shared_events import SharedEventStore
 from src.utils.temporal_roll import Rolling
-from src.xy_gen import prepare_temporal_data_for_model
+from src.xy_gen import prepare_temporal_data_for_model, prepare_cnt_for_model
 
 
 class NamedData:
@@ -16,6 +19,10 @@ class NamedData:
 
     def __init__(self, name, atemporal=False, verbose=0):
         self.named_data = {}
+        # key: dname, value: (name of the loaded data, list of categories or None for all)
+        self.sources = {}
+        # key: dname, value: sorted int64 nanoseconds of the index, for RollingPlan
+        self._times = {}
         self.name = name
         self.atemporal = atemporal
         self.verbose = verbose
@@ -31,6 +38,34 @@ class NamedData:
         subset = {dname: d[sd:ed] for dname, d in data.items()}
         return subset
 
+    def slice_rows(self, plan, period, past=True, dnames=None):
+        """same as slice_data, with the row offsets of a RollingPlan compiled by CompileData.compile_plan()
+
+        :param plan: RollingPlan
+        :param period: int, the index of the period in plan.dates
+        :param past: slice the past window (True) or the pred window (False)
+        """
+        if isinstance(dnames, str):
+            dnames = [dnames]
+        dnames = dnames if dnames else list(self.named_data.keys())
+        return {dname: self.named_data[dname].iloc[plan.rows((self.name, dname), period, past)]
+                for dname in dnames}
+
+    def times(self, dname):
+        if dname not in self._times:
+            data = self.named_data[dname]
+            self._times[dname] = data.times if isinstance(data, EventView) else to_ns(data.index)
+        return self._times[dname]
+
+    def set_data(self, dname, data, source, categories=None):
+        # row offsets of RollingPlan need time-sorted data; .loc[sd:ed] gives the same rows either way.
+        # EventViews are in time order
+        if not isinstance(data, EventView) and not data.index.is_monotonic_increasing:
+            data = data.sort_index(kind='stable')
+        self.named_data[dname] = data
+        self.sources[dname] = (source, categories)
+        self._times.pop(dname, None)
+
 
 class CompileData:
 
@@ -51,6 +86,10 @@ class CompileData:
         self.data_context = NamedData('context', verbose=verbose)
         self.data_y = NamedData('y', verbose=verbose)
         self.data_x = NamedData('X', verbose=verbose)
+        # key: dname, value: EventCube of the loaded data
+        self._cubes = {}
+        # key: dname, value: EventTable, the only copy of the loaded data; X and y hold views of it
+        self._tables = {}
 
     def load_data(self, dname):
         """select data loading function by name"""
@@ -64,7 +103,76 @@ class CompileData:
 
         func = LOAD_FUNCS[dname]
         data = func(self.spu_name, self.verbose, merge_tr_de=True)
-        self._data_loaded.named_data[dname] = data
+        self._add_loaded(dname, data)
+
+    def _add_loaded(self, dname, data):
+        """build the EventCube and EventTable of loaded data (train and dev, with spu assigned)"""
+        self._cubes[dname] = EventCube(data, self.spu.index)
+        self._tables[dname] = EventTable(data)
+        self._data_loaded.set_data(dname, self._tables[dname].view(), dname)
+        if self.verbose:
+            print('built %s, %s for data %s' % (self._cubes[dname], self._tables[dname], dname))
+
+    def preload(self, dnames, n_jobs=None):
+        """load datasets concurrently, so that setting up X and y takes about as long as the slowest dataset.
+
+        Each dataset is read in a thread (parquet/csv reading and parsing is I/O bound and releases the GIL);
+        spu assignments that need a spatial join run in a process pool, cached assignments are read in the thread.
+        The pool starts its workers from a forkserver: forking this process while the threads are inside
+        pandas/pyarrow could deadlock the workers.
+        Datasets already loaded are skipped.
+
+        :param dnames: list of dnames, e.g. ['crime', '911'], or dname/categories as in set_y
+        :param n_jobs: max number of threads and processes, default None (one per dataset)
+        :return: pd.DataFrame, index: dname, columns: seconds of read, assign, build and total
+        """
+        import multiprocessing
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        dnames = list(dict.fromkeys(d.split('/')[0] for d in dnames))
+        for dname in dnames:
+            if dname not in LOAD_FUNCS:
+                raise ValueError('Name=%s cannot be loaded, it hasnt been implemented. Supported data: %s' % (
+                    dname, ', '.join(LOAD_FUNCS.keys())))
+        dnames = [d for d in dnames if d not in self._data_loaded.named_data]
+        if not dnames:
+            return pd.DataFrame(columns=['read', 'assign', 'build', 'total'])
+
+        n_jobs = n_jobs or len(dnames)
+        spatial_join = [d for d in dnames if self.spu_name is not None and not has_assignment(self.spu_name, d)]
+        procs = None
+        if spatial_join:
+            context = multiprocessing.get_context('forkserver')
+            # imported once in the forkserver, not in every worker
+            context.set_forkserver_preload(['src.e0_load_tr_de_spu', 'geopandas'])
+            procs = ProcessPoolExecutor(min(n_jobs, len(spatial_join)), mp_context=context)
+        try:
+            with ThreadPoolExecutor(n_jobs) as threads:
+                timings = dict(zip(dnames, threads.map(lambda d: self._preload_one(d, procs), dnames)))
+        finally:
+            if procs is not None:
+                procs.shutdown()
+
+        report = pd.DataFrame.from_dict(timings, orient='index', columns=['read', 'assign', 'build', 'total'])
+        if self.verbose:
+            print('preloaded %d datasets:' % len(dnames))
+            print(report.round(2))
+        return report
+
+    def _preload_one(self, dname, procs):
+        """read, assign spus and build one dataset, the spatial join in procs if given; returns timings"""
+        start = time.time()
+        train, dev = LOAD_FUNCS[dname](None, self.verbose, merge_tr_de=False)
+        read = time.time()
+        if self.spu_name is not None:
+            if procs is not None and not has_assignment(self.spu_name, dname):
+                train, dev = procs.submit(add_spu_to_data, self.spu_name, dname, train, dev, self.verbose).result()
+            else:
+                train, dev = add_spu_to_data(self.spu_name, dname, train, dev, self.verbose)
+        assign = time.time()
+        self._add_loaded(dname, concat_events([train, dev]))
+        end = time.time()
+        return read - start, assign - read, end - assign, end - start
 
     def is_loaded(self, dname):
         """assert data sets are loaded in both train and dev set; if the data is not loaded, load the data
@@ -78,6 +186,12 @@ class CompileData:
         if dname not in self._data_loaded.named_data:
             self.load_data(dname)
 
+    def share(self, dname):
+        """copy the compact columns of the loaded data into a SharedEventStore for worker processes.
+        Pass store.handle to the workers; the caller unlinks the store when they are done."""
+        self.is_loaded(dname)
+        return SharedEventStore.create(self._tables[dname].base)
+
     def set_y(self, dname):
         """set data for y
         :param dname: str
@@ -94,15 +208,15 @@ class CompileData:
             categories = categories.split('+')
 
         self.is_loaded(dname)
-        data = self._data_loaded.named_data[dname]
+        table = self._tables[dname]
 
         if categories:
-            data_cat = get_df_categories(data)
+            data_cat = table.categories
             for c in categories:
                 assert c in data_cat, 'category: %s is not in dataset (%s)' % (c, data_cat)
-            data = data[data[COL.category].isin(categories)]
+        data = table.view(categories)
 
-        self.data_y.named_data[dname_cat] = data
+        self.data_y.set_data(dname_cat, data, dname, categories)
         if self.verbose >= 1:
             print('set data for y, dname/categories=%s' % dname_cat)
 
@@ -143,11 +257,11 @@ class CompileData:
                     print('set_x: adding groups for data ' + dname)
                 for g in groups:
                     dname_cat = '%s/%s' % (dname, '+'.join(g))
-                    self.data_x.named_data[dname_cat] = subdf_by_categories(self._data_loaded.named_data[dname], g)
+                    self.data_x.set_data(dname_cat, self._tables[dname].view(list(g)), dname, list(g))
 
             # each category not in groups is treated as a set of independent point
             if byc:
-                categories = set(get_df_categories(self._data_loaded.named_data[dname]))
+                categories = set(self._tables[dname].categories)
 
                 if self.verbose:
                     print('set_x: adding individual category of data ' + dname)
@@ -157,32 +271,84 @@ class CompileData:
 
                 for c in categories - cat_in_g:
                     dname_cat = '%s/%s' % (dname, c)
-                    self.data_x.named_data[dname_cat] = subdf_by_categories(self._data_loaded.named_data[dname], c)
+                    self.data_x.set_data(dname_cat, self._tables[dname].view(c), dname, [c])
 
             # treated as one set of homogeneous points
             if not has_group and not byc:
                 if self.verbose:
                     print('set_x: adding whole set of data ' + dname)
-                self.data_x.named_data[dname] = self._data_loaded.named_data[dname]
+                self.data_x.set_data(dname, self._data_loaded.named_data[dname], dname)
+
+    def window_cnt(self, named, sd, ed):
+        """event counts of every dname in named within [sd, ed], from the EventCube of the loaded data
+
+        :param named: NamedData, e.g. self.data_x
+        :return: pd.DataFrame, index=spu index, columns=dnames;
+            None if the window is not made of whole days or some dname has no cube
+        """
+        cnts = {}
+        for dname in named.named_data:
+            source, categories = named.sources.get(dname, (None, None))
+            cube = self._cubes.get(source)
+            if cube is None or not cube.aligned(sd, ed):
+                return None
+            cnt = cube.count(sd, ed, categories=categories) if categories else cube.total(sd, ed)
+            cnts[dname] = cnt.astype(float)
+        return pd.DataFrame(cnts, index=self.spu.index)
+
+    def compile_plan(self, roller):
+        """compile the periods of roller to row offsets of every dname in X and y
+
+        :param roller: Rolling
+        :return: RollingPlan, offsets keyed by (NamedData.name, dname)
+        """
+        plan = roller.compile()
+        for named in (self.data_x, self.data_y):
+            for dname in named.named_data:
+                plan.add((named.name, dname), named.times(dname))
+        if self.verbose:
+            print('compiled %s' % plan)
+        return plan
+
+    def prepare_data(self, named, setting, sd, ed, plan=None, period=None, past=True):
+        """data for model of window [sd, ed]; counts come from EventCubes if possible,
+        other settings slice the rows by the offsets of plan if given"""
+        if setting == 'event_cnt' or setting.startswith('hot_spot'):
+            cnts = self.window_cnt(named, sd, ed)
+            if cnts is not None:
+                return prepare_cnt_for_model(cnts, setting)
+        if plan is not None:
+            data = named.slice_rows(plan, period, past=past)
+        else:
+            data = named.slice_data(sd, ed)
+        return prepare_temporal_data_for_model(data, setting=setting, spu=self.spu)
 
-    def gen_x_y_for_model(self, x_setting, y_setting, dates):
-        # TODO: add doc string
+    def gen_x_y_for_model(self, x_setting, y_setting, dates, plan=None, period=None):
+        """X of the past window and y of the pred window
+
+        :param dates: [past_sd, past_ed, pred_sd, pred_ed], None if plan is given
+        :param plan: RollingPlan from self.compile_plan(), default None (slicing by dates)
+        :param period: int, the index of the period in plan.dates
+        """
+        if plan is not None:
+            dates = plan.dates[period]
         past_sd, past_ed, pred_sd, pred_ed = dates
         # use feature in the past predict Y in the future
         # F(x_past) = y_pred
-        data_x_past = self.data_x.slice_data(past_sd, past_ed)
-        data_y_pred = self.data_y.slice_data(pred_sd, pred_ed)
-        x = prepare_temporal_data_for_model(data_x_past, setting=x_setting, spu=self.spu)
-        y = prepare_temporal_data_for_model(data_y_pred, setting=y_setting, spu=self.spu)
+        x = self.prepare_data(self.data_x, x_setting, past_sd, past_ed, plan=plan, period=period, past=True)
+        y = self.prepare_data(self.data_y, y_setting, pred_sd, pred_ed, plan=plan, period=period, past=False)
         if y.shape[1] > 1:
             raise NotImplementedError('Multiple Y not implemented')
         # TODO: add context to x
         return x, y
 
 
-def data_for_fit(compile_data, x_setting, y_setting, dates=None, stack_roll=False, roller=None, verbose=0):
+def data_for_fit(compile_data, x_setting, y_setting, dates=None, stack_roll=False, roller=None, verbose=0,
+                 plan=None, period=None):
     # decide to use dates or roller
     use_roller = False
+    if plan is not None:
+        dates = plan.dates[period]
     if dates is None:
         if roller is None:
             raise ValueError('Pleas specify either dates or roller')
@@ -194,7 +360,7 @@ def data_for_fit(compile_data, x_setting, y_setting, dates=None, stack_roll=Fals
     if use_roller and stack_roll:
         raise NotImplementedError('stack roll not implemented')
     else:
-        x, y = compile_data.gen_x_y_for_model(x_setting, y_setting, dates)
+        x, y = compile_data.gen_x_y_for_model(x_setting, y_setting, dates, plan=plan, period=period)
 
     # print data setting
     if verbose > 1:
@@ -221,7 +387,8 @@ def evaluate(compile_data, train_roller, eval_roller, model, evaluators, refit=F
              x_setting='event_cnt', y_setting='event_cnt', verbose=0, debug=False):
     eval_res = []
     tmp_train_roller = copy.copy(train_roller)
-    for i, dates in enumerate(eval_roller.roll()):
+    plan = compile_data.compile_plan(eval_roller)
+    for i, dates in enumerate(plan.dates):
         past_sd, past_ed, pred_sd, pred_ed = dates
         period = 'X: %s~%s -> Y: %s~%s' % (past_sd, past_ed, pred_sd, pred_ed)
         res = {'period': period}
@@ -230,7 +397,7 @@ def evaluate(compile_data, train_roller, eval_roller, model, evaluators, refit=F
             X, Y = data_for_fit(compile_data, roller=tmp_train_roller, x_setting=x_setting, y_setting=y_setting,
                                 stack_roll=False, verbose=verbose)
             model.fit(X, Y)
-        eval_x, eval_y = data_for_fit(compile_data, x_setting=x_setting, y_setting=y_setting, dates=dates,
+        eval_x, eval_y = data_for_fit(compile_data, x_setting=x_setting, y_setting=y_setting, plan=plan, period=i,
                                       verbose=verbose)
         pred_y = model.predict(eval_x)
 
@@ -1,9 +1,7 @@
 # coding=utf-8
 import datetime
 
-import geopandas as gp
 import numpy as np
-from shapely.geometry import Point
 
 from src import constants as C
 
@@ -91,6 +89,8 @@ class Bower:
             x_coords = x_coords.loc[begin_date:last_date]
             self.last_date = last_date
 
+        import geopandas as gp
+        from shapely.geometry import Point
         events = gp.GeoDataFrame(x_coords.apply(lambda x: Point(*x))).rename(
             columns={C.COL.coords: 'geometry'}).reset_index()
         self.events = events
@@ -111,6 +111,8 @@ class Bower:
                 print('now_date is None, using self.last_date+1sec=%s as now_date' % now_date)
 
         # grids_center has same index as coords
+        import geopandas as gp
+        from shapely.geometry import Point
         grids = gp.GeoDataFrame(spatial_units.values)
         grids.columns = ['cen_coords']
         grids['geometry'] = grids.cen_coords.apply(lambda x: Point(*x))
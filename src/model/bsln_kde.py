@@ -3,12 +3,8 @@
 
 import datetime
 
-import geopandas as gp
 import numpy as np
 import pandas as pd
-from pyproj import Proj, transform
-from sklearn.model_selection import GridSearchCV
-from sklearn.neighbors import KernelDensity
 
 from src import constants as C
 
@@ -66,6 +62,7 @@ class KDE:
             begin_date = last_date - datetime.timedelta(days=self.tw - 1)
             x_coords = x_coords.loc[begin_date:last_date]
 
+        from sklearn.neighbors import KernelDensity
         kde = KernelDensity(bandwidth=self.bw)
         kde.fit(x_coords.tolist())
         self.estimator = kde
@@ -101,6 +98,8 @@ class KDE:
         if self.verbose > 0: print(str(bw_choice))
 
         if self.verbose > 0: print('gridsearching bw')
+        from sklearn.model_selection import GridSearchCV
+        from sklearn.neighbors import KernelDensity
         search = GridSearchCV(KernelDensity(), {'bandwidth': bw_choice}, cv=cv, verbose=self.verbose, n_jobs=n_jobs)
         search.fit(coords)
 
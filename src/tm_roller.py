@@ -7,11 +7,12 @@ from collections import defaultdict
 import pandas as pd
 
 from src import constants as C
-from src.xy_gen import y_cnt_event
+from src.xy_gen import y_cnt_event, y_cnt_assigned, y_cnt_spec
 
 
 class TM_ROLLER:
-    def __init__(self, method, named_x_events, y_events, eval_sd, eval_ed, roll_step=1, eval_tw=1, verbose=0):
+    def __init__(self, method, named_x_events, y_events, eval_sd, eval_ed, roll_step=1, eval_tw=1, verbose=0,
+                 y_spus=None):
         """
 
         Parameters
@@ -35,6 +36,10 @@ class TM_ROLLER:
 
         :param verbose: int, verbosity level
 
+        :param y_spus: pd.Series, default None
+            spu assignment of y_events (same index), e.g. COL.spu of loaded data.
+            If given, the y of each period is counted from it instead of a spatial join
+
         """
         self.method = method
         if isinstance(named_x_events, pd.Series):
@@ -42,6 +47,7 @@ class TM_ROLLER:
             if verbose > 0: print('wrap pd.Series with dict key')
         self.x_events = named_x_events
         self.y_events = y_events
+        self.y_spus = y_spus
         self.eval_sd = datetime.datetime.strptime(eval_sd, '%Y-%m-%d') if isinstance(eval_sd, str) else eval_sd
         self.eval_ed = datetime.datetime.strptime(eval_ed, '%Y-%m-%d') if isinstance(eval_ed, str) else eval_ed
         self.eval_tw = eval_tw
@@ -106,18 +112,22 @@ class TM_ROLLER:
             # test_x_events = {name: data.loc[tw_sd: tw_ed] for name, data in self.x_events.items()}
             train_y_events = self.y_events.loc[:train_ed]
             test_y_events = self.y_events.loc[tw_sd: tw_ed]
+            test_y_spus = self.y_spus.loc[tw_sd: tw_ed] if self.y_spus is not None else None
             yield {
                 'train_x_events': train_x_events,  # 'test_x_events': test_x_events,
-                'train_y_events': train_y_events, 'test_y_events': test_y_events,
+                'train_y_events': train_y_events, 'test_y_events': test_y_events, 'test_y_spus': test_y_spus,
                 'tw_sd': tw_sd, 'tw_ed': tw_ed, 'train_ed': train_ed
             }
             tw_sd += datetime.timedelta(days=self.roll_step)
             num_loops += 1
 
-    def eval(self, metrics, sp_units):
+    def eval(self, metrics, sp_units, spec=None):
         """
         :param metrics: a list of metrics for evaluation;
             if it is callable, wrap it in a list
+        :param sp_units: gp.GeoDataFrame of spatial units
+        :param spec: GridSpec or HexSpec of sp_units, default None.
+            If given (and no y_spus), the y of each period is counted by index math instead of a spatial join
         """
         if callable(metrics):
             metrics = [metrics]
@@ -137,7 +147,12 @@ class TM_ROLLER:
             # build attributes of spatial units for metrics
             su_attr = sp_units.copy()
             su_attr[C.COL.risk] = risk_score
-            su_attr[C.COL.num_events] = y_cnt_event(sp_units, r['test_y_events'])
+            if r['test_y_spus'] is not None:
+                su_attr[C.COL.num_events] = y_cnt_assigned(sp_units, r['test_y_spus'])
+            elif spec is not None:
+                su_attr[C.COL.num_events] = y_cnt_spec(sp_units, r['test_y_events'], spec)
+            else:
+                su_attr[C.COL.num_events] = y_cnt_event(sp_units, r['test_y_events'])
             for m in metrics:
                 eval_pred = m(su_attr)
                 period_str = '%s~%s' % (r['tw_sd'].strftime('%Y-%m-%d'), r['tw_ed'].strftime('%Y-%m-%d'))
@@ -2,8 +2,6 @@ import datetime
 import re
 from copy import copy
 
-import numpy as np
-
 from src.constants import DateTimeRelated as dtr, COL
 
 
@@ -25,6 +23,8 @@ def str_is_float(s):
 
 
 def loubar_thres(arr, is_sorted=False):
+    import numpy as np
+
     if not is_sorted:
         arr = copy(arr)
         arr = sorted(arr)
@@ -1,10 +1,8 @@
 # coding=utf-8
 from src import constants as C
 
+import numpy as np
 import pandas as pd
-import geopandas as gp
-from shapely.geometry import Point
-from pyproj import Proj, transform
 
 
 def prep_data_from_raw(raw, cached_path=None, col_date='Date', date_format='%m/%d/%Y', from_epsg=4326, to_epsg=None,
@@ -67,6 +65,7 @@ def prep_data_from_raw(raw, cached_path=None, col_date='Date', date_format='%m/%
     # Loading raw
     if isinstance(raw, str):
         if raw.endswith('.geojson') or raw.endswith('.shp'):
+            import geopandas as gp
             raw = gp.read_file(raw)
         elif raw.endswith('.csv'):
             raw = pd.read_csv(raw)
@@ -102,6 +101,7 @@ def prep_data_from_raw(raw, cached_path=None, col_date='Date', date_format='%m/%
     if verbose > 0:
         print('project to the to_epsg if specified', to_epsg)
     if to_epsg is not None:
+        from pyproj import Proj, transform
         from_proj = Proj(init='epsg:%d' % from_epsg)
         to_proj = Proj(init='epsg:%d' % to_epsg)
         lons = clean[C.COL.coords].apply(lambda x: x[0]).tolist()
@@ -196,6 +196,7 @@ def prep_clean_point_data(path, from_epsg=4326, to_epsg=3559, col_lat=True, col_
     if verbose > 0:
         print('project to the to_epsg if specified', to_epsg)
     if to_epsg is not None:
+        from pyproj import Proj, transform
         from_proj = Proj(init='epsg:%d' % from_epsg)
         to_proj = Proj(init='epsg:%d' % to_epsg)
         lons, lats = transform(from_proj, to_proj, lons, lats)
@@ -215,6 +216,8 @@ def prep_clean_point_data(path, from_epsg=4326, to_epsg=3559, col_lat=True, col_
 
     # transform to geopandas.GeoDataFrame
     if gpdf and not coords_series:
+        import geopandas as gp
+        from shapely.geometry import Point
         data['geometry'] = data[C.COL.coords].apply(lambda x: Point(x[0], x[1]))
         data = gp.GeoDataFrame(data)
         data.crs = {'init': 'epsg:%d' % (to_epsg if to_epsg is not None else from_epsg), 'no_defs': True}
@@ -233,6 +236,111 @@ def prep_clean_point_data(path, from_epsg=4326, to_epsg=3559, col_lat=True, col_
     return data
 
 
+def prep_clean_events(path, from_epsg=4326, to_epsg=3559, geometry=False, max_category_ratio=0.5, categories=None,
+                      verbose=0):
+    """load clean point data in the compact event schema, see to_compact_events()
+
+    :param path: cleaned point data, see prep_clean_point_data()
+    Other parameters see to_compact_events()
+    """
+    if verbose > 0: print('loading data from:', path)
+    data = pd.read_csv(path, index_col=0)
+    return to_compact_events(data, from_epsg=from_epsg, to_epsg=to_epsg, geometry=geometry,
+                             max_category_ratio=max_category_ratio, categories=categories, verbose=verbose)
+
+
+def to_compact_events(data, from_epsg=4326, to_epsg=3559, geometry=False, max_category_ratio=0.5, categories=None,
+                      verbose=0):
+    """clean point data in the compact event schema
+
+    - index: DatetimeIndex (int64 nanoseconds) named COL.datetime; Date, Time and DateTime columns are dropped
+    - COL.x, COL.y: float64 coordinates in to_epsg; Latitude, Longitude and Coords are dropped
+    - string columns with few unique values (e.g. Category, description): categorical
+    - integer columns (e.g. COL.ori_index): downcast to the smallest integer type
+    - geometry: only if requested
+
+    :param data: pd.DataFrame of cleaned point data (as written by clean_911.py, clean_crime.py),
+        indexed by the index of the raw data
+    :param from_epsg: int, epsg of raw data, default 4326
+    :param to_epsg: int, epsg of desired crs, default 3559. None: no projection
+    :param geometry: default False, if True, add a geometry column of Points and return gp.GeoDataFrame
+    :param max_category_ratio: string columns with #unique / #rows <= max_category_ratio are categorical
+    :param categories: list of the string columns that are categorical, the others stay str, default None
+        (decided by max_category_ratio). Chunks appended to one EventStore need the same list
+    :param verbose: verbosity
+    """
+    data = data.copy()
+    data.index.name = C.COL.ori_index
+    data = data.reset_index()
+
+    if verbose > 0: print('project to the to_epsg if specified', to_epsg)
+    xs, ys = data[C.COL.lon].values, data[C.COL.lat].values
+    if to_epsg is not None:
+        from pyproj import Transformer
+        xs, ys = Transformer.from_crs(from_epsg, to_epsg, always_xy=True).transform(xs, ys)
+    data[C.COL.x] = np.asarray(xs, dtype=np.float64)
+    data[C.COL.y] = np.asarray(ys, dtype=np.float64)
+
+    if C.COL.datetime in data.columns and pd.api.types.is_datetime64_any_dtype(data[C.COL.datetime]):
+        index = pd.DatetimeIndex(data[C.COL.datetime], name=C.COL.datetime)
+    else:
+        index = pd.DatetimeIndex(pd.to_datetime(data[C.COL.date] + ' ' + data[C.COL.time],
+                                                format=C.COL.datetime_format), name=C.COL.datetime)
+    data = data.drop(columns=[C.COL.lat, C.COL.lon, C.COL.coords, C.COL.date, C.COL.time, C.COL.datetime],
+                     errors='ignore')
+    data.index = index
+
+    for col in data.columns:
+        dtype = data[col].dtype
+        if dtype == object or pd.api.types.is_string_dtype(dtype):
+            if categories is not None:
+                categorical = col in categories
+            else:
+                categorical = data[col].nunique() <= max_category_ratio * len(data)
+            if categorical:
+                data[col] = data[col].astype('category')
+        elif pd.api.types.is_integer_dtype(dtype):
+            data[col] = pd.to_numeric(data[col], downcast='integer')
+
+    if geometry:
+        data = events_to_gdf(data, epsg=to_epsg if to_epsg is not None else from_epsg)
+        if verbose > 0: print('transformed to gpdf, crs=', data.crs)
+    return data
+
+
+def events_to_gdf(data, epsg=3559):
+    """gp.GeoDataFrame of events in the compact schema, with Points built from COL.x, COL.y"""
+    import geopandas as gp
+    return gp.GeoDataFrame(data, geometry=gp.points_from_xy(data[C.COL.x], data[C.COL.y]), crs='EPSG:%d' % epsg)
+
+
+def concat_events(frames):
+    """pd.concat of event tables, keeping categorical columns categorical with the union of categories"""
+    from pandas.api.types import union_categoricals
+
+    # a column categorical in any frame is categorical in the result
+    cat_cols = {col for f in frames for col in f.columns if isinstance(f[col].dtype, pd.CategoricalDtype)}
+    for col in sorted(cat_cols):
+        frames = [f.assign(**{col: f[col].astype('category')}) if col in f.columns else f for f in frames]
+        categories = union_categoricals([f[col] for f in frames if col in f.columns], ignore_order=True).categories
+        frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) if col in f.columns else f for f in frames]
+    return pd.concat(frames)
+
+
+def memory_report(named_frames):
+    """deep memory usage of frames, index included
+
+    :param named_frames: dict, key: name, value: pd.DataFrame
+    :return: pd.DataFrame, index=name, columns: #rows, MB, bytes/row
+    """
+    rows = []
+    for name, df in named_frames.items():
+        nbytes = df.memory_usage(index=True, deep=True).sum()
+        rows.append({'name': name, '#rows': len(df), 'MB': nbytes / 2 ** 20,
+                     'bytes/row': nbytes / len(df) if len(df) else 0})
+    return pd.DataFrame(rows).set_index('name')
+
+
 def main():
     d911 = prep_911(path='../' + C.PathTest.p911, verbose=1, by_category=True, coords_series=False, gpdf=True)
     if isinstance(d911, dict):
@@ -0,0 +1,163 @@
+# coding=utf-8
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from src.constants import COL, PathData
+
+
+class DatasetSource:
+    """Declarative description of an event dataset: where the raw rows are and how they become compact events
+
+    Datasets with a clean_script (crime, 911) are cleaned by that script, which writes the EventStore,
+    so they only declare their raw csv and the script;
+    the others are cleaned here from the description (see clean()), the first load builds their EventStore.
+    Either way every dataset is read from its EventStore and goes through the same spu assignment and EventCube.
+
+    Attributes
+    ----------
+    name: name of the dataset, e.g. crime, 911, key of LOAD_FUNCS
+    raw: path of the raw csv
+    columns: dict, raw column -> column of the compact events, e.g. {'Latitude': COL.lat, 'Longitude': COL.lon},
+        required (as date and date_format) without clean_script
+    date: raw column of the date
+    date_format: strptime format of date
+    time: raw column of the time, default None (events at midnight)
+    time_format: strptime format of time
+    category: raw column of the category, default None (every event is in category_value)
+    category_value: category of every event if category is None, default: name
+    cat_mapping: path of the CatMapping file of the category column, default None (raw values, stripped)
+    epsg: crs of the raw coordinates
+    address: raw column of the address, rows w/o coordinates are geocoded from it (see StreetIndex), default None
+    categories: list of the compact columns that are categorical, default [COL.category].
+        The other string columns (ids like caseNumber) stay str, all parts of the EventStore get the same dtypes
+    clean_script: script that cleans the raw rows into the EventStore, default None (cleaned by clean())
+    """
+
+    def __str__(self):
+        return 'DatasetSource(name={}, raw={}, epsg={}, clean_script={})'.format(
+            self.name, self.raw, self.epsg, self.clean_script)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, name, raw, columns=None, date=None, date_format=None, time=None, time_format=None,
+                 category=None, category_value=None, cat_mapping=None, epsg=4326, address=None, categories=None,
+                 clean_script=None):
+        if clean_script is None and (columns is None or date is None or date_format is None):
+            raise ValueError('%s: columns, date and date_format are required without a clean_script' % name)
+        self.name = name
+        self.raw = raw
+        self.columns = dict(columns) if columns is not None else None
+        self.date = date
+        self.date_format = date_format
+        self.time = time
+        self.time_format = time_format
+        self.category = category
+        self.category_value = category_value if category_value is not None else name
+        self.cat_mapping = cat_mapping
+        self.epsg = epsg
+        self.address = address
+        self.categories = list(categories) if categories is not None else [COL.category]
+        self.clean_script = clean_script
+
+    def read_raw(self):
+        usecols = set(self.columns) | {self.date}
+        usecols |= {c for c in (self.time, self.category, self.address) if c is not None}
+        return pd.read_csv(self.raw, usecols=sorted(usecols), dtype={c: str for c in (self.date, self.time) if c})
+
+    def clean(self, raw=None, geocoder=None, verbose=0):
+        """clean raw rows into compact events. Rows w/o coordinates (after geocoding) or datetime are dropped,
+        the raw row number is ori_index
+
+        :param raw: raw rows, default None (read self.raw)
+        :param geocoder: StreetIndex to geocode the rows w/o coordinates from self.address, default None
+        :return: pd.DataFrame in the compact event schema, sorted by DateTime
+        """
+        from src.utils.data_prep import to_compact_events
+
+        if self.clean_script is not None:
+            raise ValueError('%s is cleaned by %s' % (self.name, self.clean_script))
+        if raw is None:
+            raw = self.read_raw()
+        if verbose:
+            print('cleaning %d raw rows of %s' % (len(raw), self.name))
+
+        data = raw[list(self.columns)].rename(columns=self.columns)
+        datetime = pd.to_datetime(raw[self.date], format=self.date_format, errors='coerce')
+        if self.time is not None:
+            times = pd.to_datetime(raw[self.time], format=self.time_format, errors='coerce')
+            datetime = datetime + (times - times.dt.normalize())
+        data[COL.datetime] = datetime
+
+        if self.category is None:
+            data[COL.category] = pd.Categorical(np.full(len(data), self.category_value))
+        elif self.cat_mapping is None:
+            data[COL.category] = raw[self.category].str.strip().astype('category')
+        else:
+            data[COL.category] = _cat_mapping(self.cat_mapping).map_categorical(raw[self.category])
+
+        missing = data[COL.lat].isnull() | data[COL.lon].isnull()
+        if geocoder is not None and self.address is not None and missing.any():
+            points = geocoder.geocode_latlon(raw.loc[missing, self.address]).dropna()
+            data.loc[points.index, [COL.lat, COL.lon]] = points[[COL.lat, COL.lon]].values
+            if verbose:
+                print('geocoded %d of %d rows w/o coordinates' % (len(points), missing.sum()))
+        data = data[data[COL.lat].notnull() & data[COL.lon].notnull() & data[COL.datetime].notnull()]
+        # the index (raw row number) becomes ori_index in to_compact_events
+        data = data.sort_values(COL.datetime, kind='stable')
+        if verbose:
+            print('%d clean events of %s' % (len(data), self.name))
+        return to_compact_events(data, from_epsg=self.epsg, categories=self.categories)
+
+    def build_store(self, root=PathData.store, verbose=0):
+        """clean the raw rows into a new EventStore of the dataset, geocoding with PathShape.centerline if it exists"""
+        import shutil
+        from src.utils.event_store import EventStore
+        from src.utils.geocoder import get_street_index
+
+        geocoder = get_street_index() if self.address is not None else None
+        store = EventStore(root, self.name)
+        shutil.rmtree(store.path, ignore_errors=True)
+        store.write(self.clean(geocoder=geocoder, verbose=verbose), mode='append', verbose=verbose)
+        return store
+
+
+def _cat_mapping(path):
+    """CatMapping of a mapping file, category_mapping.py sits next to the mapping files"""
+    import sys
+    manual = os.path.dirname(os.path.abspath(path))
+    if manual not in sys.path:
+        sys.path.append(manual)
+    from category_mapping import CatMapping
+    return CatMapping(path)
+
+
+DATASETS = OrderedDict((source.name, source) for source in [
+    # columns, formats, category mappings and geocoding of crime and 911 are in their clean scripts
+    DatasetSource('crime', PathData.raw_crime, clean_script='data/open-baltimore/clean_crime.py',
+                  categories=['CrimeCode', 'Description', 'Weapon', 'District', 'Neighborhood', COL.category,
+                              'In/Outside']),
+    DatasetSource('911', PathData.raw_911, clean_script='data/open-baltimore/clean_911.py',
+                  categories=['description', COL.category, 'priority']),
+    DatasetSource('arrest', PathData.raw_arrest,
+                  columns={'Latitude': COL.lat, 'Longitude': COL.lon, 'Arrest': 'Arrest', 'Charge': 'Charge'},
+                  date='ArrestDate', date_format='%m/%d/%Y', time='ArrestTime', time_format='%H:%M',
+                  category='IncidentOffense', address='ArrestLocation', categories=[COL.category, 'Charge']),
+    DatasetSource('gun_offender', PathData.raw_gun_offender,
+                  columns={'Latitude': COL.lat, 'Longitude': COL.lon, 'caseNumber': 'caseNumber'},
+                  date='created_date', date_format='%m/%d/%Y', address='full_address'),
+])
+
+
+def main():
+    for name, source in DATASETS.items():
+        print(source)
+        if source.clean_script is None and os.path.exists(source.raw):
+            print(source.build_store(verbose=1))
+
+
+if __name__ == '__main__':
+    main()
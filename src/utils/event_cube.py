@@ -0,0 +1,153 @@
+# coding=utf-8
+import numpy as np
+import pandas as pd
+
+from src.constants import COL
+
+NS_PER_DAY = 86400 * 10 ** 9
+
+
+def to_ns(times):
+    """int64 nanoseconds since epoch of datetime-like array/index"""
+    return np.asarray(pd.DatetimeIndex(times).as_unit('ns').asi8)
+
+
+class EventCube:
+    """Day-bucketed event counts of one dataset: day x spu x category, with prefix sums along days
+
+    Built once at load time. The count matrix (spu x category) of any window of whole days is the difference
+    of two prefix slices, so it doesn't scale with the number of events in the window.
+
+    - If days x spu x category is small (<= dense_limit cells), the prefix sums are a dense array,
+      window = prefix[b] - prefix[a].
+    - Otherwise, the non-empty (spu, category, day) buckets are sorted by (spu, category, day)
+      and the prefix sums run over that order; a window is two np.searchsorted per non-empty (spu, category).
+
+    Events of no category in categories (e.g. NaN, unmapped) are counted in an extra last slot,
+    so that total() counts every event of the spus, as groupby(COL.spu).size() does.
+
+    Attributes
+    ----------
+    spu_index: pd.Index of the spatial units
+    categories: pd.Index of the categories
+    day0: pd.Timestamp, the first day of the cube
+    n_days: number of days in the cube
+    """
+
+    def __str__(self):
+        return 'EventCube(#days={}, #spu={}, #categories={}, #events={}, dense={})'.format(
+            self.n_days, len(self.spu_index), len(self.categories), self.n_events, self.dense)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, data, spu_index, categories=None, dense_limit=10 ** 7):
+        """
+        :param data: pd.DataFrame indexed by DateTime, with columns COL.spu and COL.category
+        :param spu_index: index of the spatial units, e.g. CompileData.spu.index
+        :param categories: list of categories, default None (sorted categories in data)
+        :param dense_limit: max number of cells of the dense prefix sums
+        """
+        self.spu_index = pd.Index(spu_index)
+        if categories is None:
+            categories = sorted(data[COL.category].dropna().unique())
+        self.categories = pd.Index(categories)
+
+        times = to_ns(data.index)
+        self.day0 = pd.Timestamp(times.min() if len(times) else 0).normalize()
+        days = (times - self.day0.value) // NS_PER_DAY
+        self.n_days = int(days.max()) + 1 if len(days) else 0
+
+        spu_code = self.spu_index.get_indexer(data[COL.spu].values)
+        cat_code = self.categories.get_indexer(data[COL.category].values)
+        # the slot of the events of other categories
+        self.n_slots = len(self.categories) + 1
+        cat_code = np.where(cat_code >= 0, cat_code, len(self.categories))
+        valid = spu_code >= 0
+        self.n_events = int(valid.sum())
+        self.n_cols = len(self.spu_index) * self.n_slots
+        cols = spu_code[valid] * self.n_slots + cat_code[valid]
+        days = days[valid]
+
+        self.dense = self.n_cols * (self.n_days + 1) <= dense_limit
+        if self.dense:
+            daily = np.zeros((self.n_days + 1, self.n_cols), dtype=np.int32)
+            np.add.at(daily, (days + 1, cols), 1)
+            self._prefix = np.cumsum(daily, axis=0, out=daily)
+        else:
+            keys, cnts = np.unique(cols * self.n_days + days, return_counts=True)
+            self._keys = keys
+            self._prefix = np.concatenate([[0], np.cumsum(cnts)])
+            # non-empty (spu, category) columns
+            self._cols = np.unique(keys // self.n_days)
+
+    def day_bounds(self, sd, ed):
+        """[sd, ed] -> [a, b) in day offsets of the cube. Pandas slicing semantics:
+        sd should be a midnight, ed should be the last second of a day (as Rolling.roll() produces)
+        or a date string ('%Y-%m-%d', the whole day is included).
+        Raise ValueError if the window is not made of whole days.
+        """
+        sd = pd.Timestamp(sd)
+        if sd != sd.normalize():
+            raise ValueError('sd=%s is not aligned to a day' % sd)
+        if isinstance(ed, str) and len(ed) == len('2018-01-01'):
+            end = pd.Timestamp(ed) + pd.Timedelta(days=1)
+        else:
+            end = pd.Timestamp(ed) + pd.Timedelta(seconds=1)
+            if end != end.normalize():
+                raise ValueError('ed=%s is not the last second of a day' % ed)
+        a = (sd - self.day0).days
+        b = (end - self.day0).days
+        return min(max(a, 0), self.n_days), min(max(b, a, 0), self.n_days)
+
+    def aligned(self, sd, ed):
+        try:
+            self.day_bounds(sd, ed)
+            return True
+        except ValueError:
+            return False
+
+    def window(self, a, b):
+        """counts of days [a, b), np.ndarray of shape (#spu, #categories + 1), the last column: other categories"""
+        if self.dense:
+            cnt = self._prefix[b] - self._prefix[a]
+        else:
+            cnt = np.zeros(self.n_cols, dtype=np.int64)
+            base = self._cols * self.n_days
+            lo = np.searchsorted(self._keys, base + a)
+            hi = np.searchsorted(self._keys, base + b)
+            cnt[self._cols] = self._prefix[hi] - self._prefix[lo]
+        return cnt.reshape(len(self.spu_index), self.n_slots)
+
+    def count(self, sd, ed, categories=None):
+        """counts of events in [sd, ed]
+
+        :param sd, ed: see day_bounds()
+        :param categories: None: all categories, one column per category;
+            list of categories: one column, the sum of these categories
+        :return: np.ndarray of shape (#spu, #categories) or (#spu,)
+        """
+        cnt = self.window(*self.day_bounds(sd, ed))
+        if categories is None:
+            return cnt[:, :-1]
+        codes = self.categories.get_indexer(list(categories))
+        return cnt[:, codes[codes >= 0]].sum(axis=1)
+
+    def total(self, sd, ed):
+        """counts of all events in [sd, ed], whatever their category (NaN included), np.ndarray of shape (#spu,)"""
+        return self.window(*self.day_bounds(sd, ed)).sum(axis=1)
+
+
+def main():
+    idx = pd.to_datetime(['2015-01-01 10:00', '2015-01-02 11:00', '2015-01-02 12:00', '2015-01-05 00:00'])
+    data = pd.DataFrame({COL.spu: [0, 1, 1, 2], COL.category: ['a', 'b', 'a', 'a']}, index=idx)
+    for dense_limit in [10 ** 6, 0]:
+        cube = EventCube(data, range(3), dense_limit=dense_limit)
+        print(cube)
+        print(cube.count('2015-01-01', '2015-01-02 23:59:59'))
+        print(cube.count('2015-01-02', '2015-01-05', categories=['a']))
+        print(cube.total('2015-01-01', '2015-01-05'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# coding=utf-8
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.constants import COL, DateTimeRelated as dtr
+from src.utils.data_prep import concat_events
+
+# split -> [sd, ed) of the split
+SPLITS = {
+    'train': (dtr.train_sd, dtr.train_ed),
+    'dev': (dtr.dev_sd, dtr.dev_ed),
+    'test': (dtr.test_sd, dtr.test_ed),
+}
+
+
+def split_of(index):
+    """name of the split (train, dev, test) of each time in index,
+    'live' if in none of them (e.g. after the test set)
+
+    :param index: pd.DatetimeIndex
+    :return: np.ndarray of str
+    """
+    names = np.full(len(index), 'live', dtype=object)
+    for split, (sd, ed) in SPLITS.items():
+        names[(index >= sd) & (index < ed)] = split
+    return names
+
+
+class EventStore:
+    """Clean events of one dataset, partitioned by month in parquet files
+
+    Layout: root/dname/month=YYYY-MM/part-NNNNN.parquet, one row per event in the compact event schema
+    (see prep_clean_events), DateTime as a column. Appending to a month adds a part file.
+    read() opens only the partitions of the months overlapping [sd, ed], only the requested columns,
+    and pushes the category filter down to the parquet reader.
+    Train/dev/test are date predicates over the store (see SPLITS).
+
+    Attributes
+    ----------
+    root: root directory of the store, e.g. PathData.store
+    dname: name of the dataset, e.g. crime, 911
+    """
+
+    def __str__(self):
+        months = self.months()
+        return 'EventStore(path={}, #months={}{})'.format(
+            self.path, len(months), ', %s~%s' % (months[0], months[-1]) if months else '')
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, root, dname):
+        self.root = root
+        self.dname = dname
+
+    @property
+    def path(self):
+        return os.path.join(self.root, self.dname)
+
+    def exists(self):
+        return len(self.months()) > 0
+
+    def months(self):
+        """sorted list of months (YYYY-MM) in the store"""
+        dirs = glob.glob(os.path.join(self.path, 'month=*'))
+        return sorted(os.path.basename(d)[len('month='):] for d in dirs if os.listdir(d))
+
+    def month_dir(self, month):
+        return os.path.join(self.path, 'month=%s' % month)
+
+    def write(self, data, mode='append', verbose=0):
+        """write events into their month partitions
+
+        :param data: pd.DataFrame in the compact event schema, indexed by DateTime
+        :param mode: 'append': add a part file to each month; 'overwrite': replace the months in data
+        :return: list of the months written
+        """
+        import shutil
+
+        if mode not in ('append', 'overwrite'):
+            raise ValueError('mode should be one of: append, overwrite')
+        data = pd.DataFrame(data.drop(columns=['geometry', COL.spu], errors='ignore'))
+        months = data.index.strftime('%Y-%m')
+        written = []
+        for month, part in data.groupby(months, sort=True):
+            mdir = self.month_dir(month)
+            if mode == 'overwrite' and os.path.exists(mdir):
+                shutil.rmtree(mdir)
+            os.makedirs(mdir, exist_ok=True)
+            n_parts = len(glob.glob(os.path.join(mdir, 'part-*.parquet')))
+            part.sort_index(kind='stable').reset_index().to_parquet(
+                os.path.join(mdir, 'part-%05d.parquet' % n_parts), index=False)
+            written.append(month)
+        if verbose:
+            print('wrote %d events into %d months of %s' % (len(data), len(written), self.path))
+        return written
+
+    def files(self, sd=None, ed=None):
+        """parquet files of the months overlapping [sd, ed]"""
+        lo = pd.Timestamp(sd).strftime('%Y-%m') if sd is not None else None
+        hi = pd.Timestamp(ed).strftime('%Y-%m') if ed is not None else None
+        months = [m for m in self.months() if (lo is None or m >= lo) and (hi is None or m <= hi)]
+        return [f for m in months for f in sorted(glob.glob(os.path.join(self.month_dir(m), 'part-*.parquet')))]
+
+    def read(self, sd=None, ed=None, categories=None, columns=None, split=None):
+        """events in [sd, ed] (same semantics as .loc[sd:ed]) or in a split
+
+        :param sd, ed: datetime-like or string, default None (no bound)
+        :param categories: list of categories to keep, default None (all)
+        :param columns: list of columns to read, default None (all). DateTime is always read as the index
+        :param split: 'train', 'dev' or 'test', events in [sd, ed) of SPLITS[split]; overrides sd, ed
+        :return: pd.DataFrame indexed by DateTime, time-sorted
+        """
+        if split is not None:
+            sd, ed = SPLITS[split]
+            data = self.read(sd, ed, categories=categories, columns=columns)
+            return data[data.index < ed]
+
+        if columns is not None:
+            columns = [COL.datetime] + [c for c in columns if c != COL.datetime]
+        filters = [(COL.category, 'in', list(categories))] if categories is not None else None
+        files = self.files(sd, ed)
+        if not files and self.exists():
+            # no month in [sd, ed]: no events, with the columns and dtypes of the store
+            return pd.read_parquet(self.files()[0], columns=columns).iloc[:0].set_index(COL.datetime)
+        if not files:
+            return pd.DataFrame(columns=[c for c in (columns or []) if c != COL.datetime],
+                                index=pd.DatetimeIndex([], name=COL.datetime))
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        tables = [pq.read_table(f, columns=columns, filters=filters) for f in files]
+        if all(t.schema.equals(tables[0].schema) for t in tables):
+            # one conversion to pandas, categorical columns get the union of the categories of the files
+            data = pa.concat_tables(tables).to_pandas()
+        else:
+            # parts written with other dtypes (e.g. integers downcast per appended chunk)
+            data = concat_events([t.to_pandas() for t in tables])
+        data = data.set_index(COL.datetime).sort_index(kind='stable')
+        return data.loc[sd:ed]
+
+
+def build_store(root, dname, verbose=0):
+    """convert the train/dev/test clean csv of a dataset into a month-partitioned EventStore"""
+    from src.constants import PathData
+    from src.utils.data_prep import prep_clean_events
+    from src.utils.dataset_registry import DATASETS
+
+    categories = DATASETS[dname].categories if dname in DATASETS else None
+    store = EventStore(root, dname)
+    for split in ('train', 'dev', 'test'):
+        path = PathData.as_dict[split][dname]
+        if not os.path.exists(path):
+            if verbose:
+                print('%s does not exist, skipped' % path)
+            continue
+        store.write(prep_clean_events(path, categories=categories, verbose=verbose), mode='overwrite', verbose=verbose)
+    return store
+
+
+def main():
+    import sys
+    from src.constants import PathData
+
+    for dname in sys.argv[1:] or ['crime', '911']:
+        print(build_store(PathData.store, dname, verbose=1))
+
+
+if __name__ == '__main__':
+    main()
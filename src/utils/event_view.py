@@ -0,0 +1,143 @@
+# coding=utf-8
+import numpy as np
+import pandas as pd
+
+from src.constants import COL
+from src.utils.event_cube import to_ns
+
+
+class EventTable:
+    """One copy of an event table, sorted by (category, datetime), handing out views of categories
+
+    The rows of a category are a contiguous range of the base table; the view of several categories
+    (or of all events) is an index array of the base rows in time order. Nothing else is copied.
+
+    Attributes
+    ----------
+    base: pd.DataFrame indexed by DateTime, sorted by (category, datetime)
+    times: np.ndarray of int64 nanoseconds of the base rows
+    categories: list of categories, sorted
+    ranges: dict, key: category, value: slice of the rows of the category in base
+    """
+
+    def __str__(self):
+        return 'EventTable(#events={}, #categories={})'.format(len(self.base), len(self.categories))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, data):
+        """
+        :param data: pd.DataFrame indexed by DateTime, with column COL.category
+        """
+        times = to_ns(data.index)
+        # rank of each row in time order; ties keep the original order, as .sort_index(kind='stable')
+        rank = np.empty(len(times), dtype=np.int64)
+        rank[np.argsort(times, kind='stable')] = np.arange(len(times))
+
+        codes, categories = pd.factorize(data[COL.category], sort=True)
+        order = np.lexsort((rank, codes))
+        self.base = data.iloc[order]
+        self.times = times[order]
+        self._rank = rank[order]
+        self.categories = list(categories)
+
+        codes = codes[order]
+        cat_codes = np.arange(len(self.categories))
+        starts = np.searchsorted(codes, cat_codes, side='left')
+        stops = np.searchsorted(codes, cat_codes, side='right')
+        self.ranges = {c: slice(int(a), int(b)) for c, a, b in zip(self.categories, starts, stops)}
+        self._all = None
+
+    def view(self, categories=None):
+        """
+        :param categories: None (all events), str (one category) or list of categories
+        :return: EventView, in time order
+        """
+        if categories is None:
+            if self._all is None:
+                self._all = np.argsort(self._rank)
+            return EventView(self.base, self._all, self.times)
+        if isinstance(categories, str):
+            return EventView(self.base, self.ranges.get(categories, slice(0, 0)), self.times)
+        rows = [np.arange(self.ranges[c].start, self.ranges[c].stop) for c in categories if c in self.ranges]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        return EventView(self.base, rows[np.argsort(self._rank[rows])], self.times)
+
+
+class EventView:
+    """Time-ordered rows of an EventTable, materialized only when a window of it is taken
+
+    Duck-types the parts of a pd.DataFrame used by NamedData:
+    view[sd:ed] (label slicing, pandas semantics), view.iloc[a:b], view.index and len(view).
+
+    Attributes
+    ----------
+    base: the base table
+    rows: slice (a contiguous range) or np.ndarray of positions of the base rows
+    times: np.ndarray of int64 nanoseconds of the rows
+    """
+
+    def __str__(self):
+        return 'EventView(#events={}, contiguous={})'.format(len(self), isinstance(self.rows, slice))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, base, rows, base_times):
+        self.base = base
+        self.rows = rows
+        self.times = base_times[rows]
+        self._index = None
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self.base.index[self.rows]
+        return self._index
+
+    @property
+    def frame(self):
+        """the rows as a pd.DataFrame"""
+        return self.base.iloc[self.rows]
+
+    @property
+    def iloc(self):
+        return _ViewILoc(self)
+
+    def _base_rows(self, key):
+        """positions in the view -> positions in the base"""
+        if isinstance(self.rows, slice):
+            r = range(len(self.base))[self.rows][key]
+            return slice(r.start, r.stop, r.step) if isinstance(r, range) else r
+        return self.rows[key]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('EventView supports slicing by datetime only, use .frame for the DataFrame')
+        return self.iloc[self.index.slice_indexer(key.start, key.stop)]
+
+
+class _ViewILoc:
+    def __init__(self, view):
+        self.view = view
+
+    def __getitem__(self, key):
+        return self.view.base.iloc[self.view._base_rows(key)]
+
+
+def main():
+    idx = pd.to_datetime(['2015-01-01 10:00', '2015-01-02 11:00', '2015-01-02 12:00', '2015-01-05 00:00'])
+    data = pd.DataFrame({COL.spu: [0, 1, 1, 2], COL.category: ['a', 'b', 'a', 'a']}, index=idx)
+    table = EventTable(data)
+    print(table, table.ranges)
+    print(table.view('a')['2015-01-02':'2015-01-05'])
+    print(table.view(['a', 'b']).iloc[1:3])
+    print(table.view().frame)
+
+
+if __name__ == '__main__':
+    main()
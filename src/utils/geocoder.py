@@ -0,0 +1,191 @@
+# coding=utf-8
+import re
+
+import numpy as np
+import pandas as pd
+
+# words of street names -> their abbreviation in normalized names
+STREET_WORDS = {
+    'STREET': 'ST', 'AVENUE': 'AVE', 'AV': 'AVE', 'ROAD': 'RD', 'DRIVE': 'DR', 'BOULEVARD': 'BLVD', 'LANE': 'LN',
+    'COURT': 'CT', 'PLACE': 'PL', 'TERRACE': 'TER', 'PARKWAY': 'PKWY', 'HIGHWAY': 'HWY', 'CIRCLE': 'CIR',
+    'SQUARE': 'SQ', 'ALLEY': 'ALY', 'WAY': 'WAY', 'EXPRESSWAY': 'EXPY',
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W', 'SAINT': 'ST', 'MOUNT': 'MT',
+}
+ADDRESS_PATTERN = r'^\s*(?P<number>\d+)[A-Z]?(?:-\d+)?\s+(?P<street>.+?)\s*$'
+# address ranges are searched by key street code * RANGE_BASE + house number
+RANGE_BASE = 10 ** 6
+
+
+def normalize_street(names):
+    """normalized street names: upper case, no punctuation, single spaces, abbreviated words (see STREET_WORDS).
+    Each unique name is normalized once
+
+    :param names: pd.Series of str
+    :return: pd.Series of str, NaN stays NaN
+    """
+    codes, uniques = pd.factorize(pd.Series(names))
+    normalized = [' '.join(STREET_WORDS.get(w, w) for w in re.sub(r'[^A-Z0-9 ]', ' ', u.upper()).split())
+                  for u in uniques]
+    return pd.Series(np.append(np.array(normalized, dtype=object), np.nan)[codes], index=names.index)
+
+
+def parse_address(addresses):
+    """house number and normalized street of addresses like '2800 HARLEM AVE'
+
+    :param addresses: pd.Series of str
+    :return: pd.DataFrame, columns: number (float, NaN if there is no house number), street
+    """
+    parts = pd.Series(addresses, dtype=str).str.upper().str.extract(ADDRESS_PATTERN)
+    return pd.DataFrame({'number': pd.to_numeric(parts['number']), 'street': normalize_street(parts['street'])},
+                        index=parts.index)
+
+
+class StreetIndex:
+    """Offline geocoder: street centerline segments indexed by normalized street name and address range
+
+    Street names are hashed to codes (a dict), segments are sorted by (street code, lowest address).
+    A batch of addresses is located by np.searchsorted (a second one over the running max of the highest address
+    of each street finds ranges overlapped by a later segment), then interpolated along the matched segments
+    (shapely.line_interpolate_point over all of them), so no address is geocoded in a python loop.
+
+    Attributes
+    ----------
+    crs: crs of the segments and of the geocoded points
+    streets: dict, normalized street name -> street code
+    """
+
+    def __str__(self):
+        return 'StreetIndex(#streets={}, #segments={}, crs={})'.format(len(self.streets), len(self._lo), self.crs)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, centerlines, street_col='FULLNAME', range_cols=('L_F_ADD', 'L_T_ADD', 'R_F_ADD', 'R_T_ADD'),
+                 to_epsg=3559):
+        """
+        :param centerlines: gp.GeoDataFrame of street centerline segments (LineStrings)
+            with a street name column and the address range columns of both sides
+        :param street_col: column of the street name
+        :param range_cols: columns of the address ranges: left from, left to, right from, right to.
+            The range of a segment is [min, max] of them
+        :param to_epsg: crs to interpolate in and of the geocoded points
+        """
+        centerlines = centerlines.to_crs(epsg=to_epsg)
+        self.crs = centerlines.crs
+        ranges = centerlines[list(range_cols)].apply(pd.to_numeric, errors='coerce')
+        lo, hi = ranges.min(axis=1).values, ranges.max(axis=1).values
+        streets = normalize_street(centerlines[street_col].astype(str)).values
+        keep = ~np.isnan(lo) & ~np.isnan(hi) & (hi > 0)
+
+        codes, names = pd.factorize(streets[keep])
+        self.streets = {name: code for code, name in enumerate(names)}
+        order = np.lexsort((lo[keep], codes))
+        self._street = codes[order]
+        self._lo = lo[keep][order]
+        self._hi = hi[keep][order]
+        self._keys = self._street * RANGE_BASE + self._lo
+        # ranges of a street may overlap (e.g. 100-300 then 200-250), the running max of hi is sorted like _keys
+        self._hi_keys = self._street * RANGE_BASE + pd.Series(self._hi).groupby(self._street).cummax().values
+        self._geoms = centerlines.geometry.values[keep][order]
+        # segments drawn against the address order (from-address > to-address) are interpolated from the other end
+        start = ranges.iloc[:, [0, 2]].min(axis=1).values
+        end = ranges.iloc[:, [1, 3]].max(axis=1).values
+        self._reversed = (start > end)[keep][order]
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """StreetIndex of a centerline shapefile/geojson, or GeoParquet (.parquet)"""
+        import geopandas as gp
+
+        centerlines = gp.read_parquet(path) if path.endswith('.parquet') else gp.read_file(path)
+        return cls(centerlines, **kwargs)
+
+    def locate(self, numbers, streets):
+        """segment of each address, -1 if the street is unknown or no segment covers the number
+
+        :param numbers: np.ndarray of house numbers (float, NaN if unknown)
+        :param streets: array-like of normalized street names
+        :return: np.ndarray of int, positions of the segments
+        """
+        codes = pd.Series(streets).map(self.streets).fillna(-1).astype(int).values
+        numbers = np.asarray(numbers, dtype=float)
+        valid = (codes >= 0) & ~np.isnan(numbers)
+        keys = np.where(valid, codes * RANGE_BASE + np.nan_to_num(numbers), -1)
+        if not len(self._keys):
+            return np.full(len(numbers), -1)
+        # last segment starting at or below the number
+        seg = np.clip(np.searchsorted(self._keys, keys, side='right') - 1, 0, len(self._keys) - 1)
+        # it may end below the number while an earlier, longer segment covers it:
+        # the first segment whose running max of hi reaches the number does
+        first = np.clip(np.searchsorted(self._hi_keys, keys, side='left'), 0, len(self._keys) - 1)
+        seg = np.where(self._hi[seg] >= numbers, seg, first)
+        valid &= (self._street[seg] == codes) & (self._lo[seg] <= numbers) & (self._hi[seg] >= numbers)
+        return np.where(valid, seg, -1)
+
+    def geocode(self, addresses):
+        """points of addresses, interpolated along the street segment covering the house number.
+        Addresses repeat a lot (crimes are reported by block): each unique address is geocoded once
+
+        :param addresses: pd.Series of str, e.g. '2800 HARLEM AVE'
+        :return: pd.DataFrame with the index of addresses, columns: X, Y (NaN if not found), in self.crs
+        """
+        import shapely
+        from src.constants import COL
+
+        codes, uniques = pd.factorize(addresses)
+        parsed = parse_address(pd.Series(uniques, dtype=str))
+        seg = self.locate(parsed['number'].values, parsed['street'].values)
+        found = seg >= 0
+        # the last row: missing addresses (code -1)
+        xy = np.full((len(seg) + 1, 2), np.nan)
+        if found.any():
+            s = seg[found]
+            span = self._hi[s] - self._lo[s]
+            # a segment with a single address: its middle
+            frac = np.where(span > 0, (parsed['number'].values[found] - self._lo[s]) / np.maximum(span, 1), 0.5)
+            frac = np.where(self._reversed[s], 1 - frac, frac)
+            points = shapely.line_interpolate_point(self._geoms[s], frac, normalized=True)
+            xy[:-1][found] = shapely.get_coordinates(points)
+        xy = xy[codes]
+        return pd.DataFrame({COL.x: xy[:, 0], COL.y: xy[:, 1]}, index=addresses.index)
+
+    def geocode_latlon(self, addresses):
+        """geocode(), in EPSG:4326: columns Latitude, Longitude, as the raw data"""
+        from pyproj import Transformer
+        from src.constants import COL
+
+        xy = self.geocode(addresses)
+        transformer = Transformer.from_crs(self.crs, 'EPSG:4326', always_xy=True)
+        lon, lat = transformer.transform(xy[COL.x].values, xy[COL.y].values)
+        return pd.DataFrame({COL.lat: lat, COL.lon: lon}, index=addresses.index).where(xy.notnull().values)
+
+
+def get_street_index(path=None):
+    """StreetIndex of PathShape.centerline, None if the centerline file isn't there"""
+    import os
+    from src.constants import PathShape
+
+    path = PathShape.centerline if path is None else path
+    return StreetIndex.from_file(path) if os.path.exists(path) else None
+
+
+def main():
+    import geopandas as gp
+    from shapely.geometry import LineString
+
+    # St Paul Street has overlapping ranges: 100-300 and 200-250, 260 is only on the first segment
+    lines = gp.GeoDataFrame({'FULLNAME': ['Harlem Avenue', 'N Charles Street', 'St Paul Street', 'St Paul Street'],
+                             'L_F_ADD': [2801, 1, 101, 201], 'L_T_ADD': [2899, 99, 299, 249],
+                             'R_F_ADD': [2800, 2, 100, 200], 'R_T_ADD': [2898, 98, 300, 250]},
+                            geometry=[LineString([(0, 0), (100, 0)]), LineString([(0, 0), (0, 100)]),
+                                      LineString([(200, 0), (200, 200)]), LineString([(300, 0), (300, 50)])],
+                            crs='EPSG:3559')
+    index = StreetIndex(lines)
+    print(index)
+    addresses = pd.Series(['2850 HARLEM AVE', '50 NORTH CHARLES ST', '260 ST PAUL ST', '220 ST PAUL ST',
+                           '10 UNKNOWN ST', 'no number'])
+    print(index.geocode(addresses))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# coding=utf-8
+import numpy as np
+
+from src.utils.grid_spec import GridSpec
+
+
+class GridPyramid:
+    """Multi-resolution grids built on nested lattices
+
+    Every level shares the origin of the base (finest) lattice, and its side is a multiple of the base side,
+    so each base cell falls in exactly one cell of every coarser level.
+    A count or a prediction on the base grids is then aggregated exactly to every level,
+    e.g. one model run on grid_50 gives predictions on 100, 200, 250 and 1000 m grids.
+
+    Attributes
+    ----------
+    base: GridSpec of the finest level
+    levels: dict, key=side, value=GridSpec of that level (the base included)
+    parents: dict, key=side, value=np.ndarray of level spu index of each base spu
+    """
+
+    def __str__(self):
+        return 'GridPyramid(base side={}, levels={})'.format(self.base.side, sorted(self.levels.keys()))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, base, sides):
+        """
+        :param base: GridSpec of the finest level
+        :param sides: list of sides of the coarser levels, each must be a multiple of base.side
+        """
+        self.base = base
+        self.levels = {base.side: base}
+        self.parents = {base.side: np.arange(base.n_spu)}
+        # base spus sorted by parent, and the start of each parent in the sorted order, for np.add.reduceat
+        self._order = {base.side: np.arange(base.n_spu)}
+        self._starts = {base.side: np.arange(base.n_spu)}
+
+        base_rows, base_cols = base.rowcol()
+        for side in sides:
+            side = float(side)
+            factor = side / base.side
+            if abs(factor - round(factor)) > 1e-9 or factor < 1:
+                raise ValueError('side=%s is not a multiple of the base side=%s' % (side, base.side))
+            factor = int(round(factor))
+            nrows, ncols = -(-base.nrows // factor), -(-base.ncols // factor)
+            cells = (base_rows // factor) * ncols + base_cols // factor
+            # a coarse cell is active if any of its children is active
+            level_cells, parent = np.unique(cells, return_inverse=True)
+            self.levels[side] = GridSpec(base.origin, side, nrows, ncols, crs=base.crs, cells=level_cells)
+            self.parents[side] = parent.ravel()
+            order = np.argsort(self.parents[side], kind='stable')
+            self._order[side] = order
+            self._starts[side] = np.flatnonzero(np.r_[True, np.diff(self.parents[side][order]) != 0])
+
+    @property
+    def sides(self):
+        return sorted(self.levels.keys())
+
+    def n_children(self, side):
+        """number of base spus in each spu of the level"""
+        return np.bincount(self.parents[float(side)], minlength=self.levels[float(side)].n_spu)
+
+    def parent_map(self, fine_side, coarse_side):
+        """spu index in the coarse level of each spu in the fine level"""
+        fine_side, coarse_side = float(fine_side), float(coarse_side)
+        factor = coarse_side / fine_side
+        if abs(factor - round(factor)) > 1e-9 or factor < 1:
+            raise ValueError('level %s is not nested in level %s' % (fine_side, coarse_side))
+        # all base children of a fine cell share the same coarse parent, take the first one
+        first_child = self._order[fine_side][self._starts[fine_side]]
+        return self.parents[coarse_side][first_child]
+
+    def aggregate(self, values, side, how='sum'):
+        """aggregate base values to a level
+
+        :param values: np.ndarray, shape=(n_base_spu,) or (n_periods, n_base_spu)
+        :param side: side of the level
+        :param how: 'sum' (e.g. counts, risks) or 'mean' (average over base spus)
+        :return: np.ndarray, shape=(n_level_spu,) or (n_periods, n_level_spu)
+        """
+        side = float(side)
+        values = np.asarray(values, dtype=float)
+        if values.shape[-1] != self.base.n_spu:
+            raise ValueError('values should have %d base spus, got %d' % (self.base.n_spu, values.shape[-1]))
+        if values.ndim == 1:
+            res = np.bincount(self.parents[side], weights=values, minlength=self.levels[side].n_spu)
+        else:
+            res = np.add.reduceat(values[:, self._order[side]], self._starts[side], axis=1)
+        if how == 'mean':
+            res = res / self.n_children(side)
+        elif how != 'sum':
+            raise ValueError('how should be one of: sum, mean')
+        return res
+
+    def aggregate_all(self, values, how='sum'):
+        """aggregate base values to every level, dict key=side, value=aggregated values"""
+        return {side: self.aggregate(values, side, how=how) for side in self.sides}
+
+    def to_gdf(self, side):
+        """gp.GeoDataFrame of the grids of a level"""
+        return self.levels[float(side)].to_gdf()
+
+    @classmethod
+    def from_spu(cls, base_name, sides):
+        """
+        :param base_name: name of the base grid spu, e.g. 'grid_50'
+        :param sides: sides of the coarser levels, e.g. [100, 200, 250, 1000]
+        """
+        from src.utils.spatial_unit import get_grid_spec
+        return cls(get_grid_spec(base_name), sides)
+
+
+def main():
+    from shapely.geometry import Point
+    from src.utils.spatial_unit import get_grids
+
+    base = GridSpec.from_grids(get_grids(Point(0, 0).buffer(1000), 50))
+    pyramid = GridPyramid(base, [100, 200, 250, 1000])
+    print(pyramid)
+    values = np.random.poisson(1, size=(3, base.n_spu))
+    for side, agg in pyramid.aggregate_all(values).items():
+        print(side, agg.shape, agg.sum(axis=1))
+    print(pyramid.parent_map(100, 200)[:10])
+
+
+if __name__ == '__main__':
+    main()
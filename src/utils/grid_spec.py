@@ -0,0 +1,227 @@
+# coding=utf-8
+import json
+
+import numpy as np
+
+from src import constants as C
+
+# (drow, dcol) of the neighbors, rook neighbors first
+ROOK_OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+QUEEN_OFFSETS = ROOK_OFFSETS + ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+class GridSpec:
+    """Implicit lattice of square grids, index math without geometry
+
+    The lattice has nrows x ncols cells of size side x side, starting at origin (the lower left corner).
+    Cells are numbered row by row (south to north), west to east within a row: cell = row * ncols + col.
+    Only active cells are spatial units; the spu index of an active cell is its rank among active cells,
+    which is the order get_grids() produces.
+
+    Attributes
+    ----------
+    origin: (x, y) of the lower left corner of the lattice
+    side: side of a cell, in the unit of the crs
+    nrows, ncols: shape of the lattice
+    crs: string of the crs, e.g. 'EPSG:3559'
+    cells: np.ndarray of int64, flat cell id of each spu, sorted
+    """
+
+    def __str__(self):
+        return ('GridSpec(origin={}, side={}, nrows={}, ncols={}, crs={}, #spu={})'
+                ''.format(self.origin, self.side, self.nrows, self.ncols, self.crs, self.n_spu))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, origin, side, nrows, ncols, crs=None, cells=None):
+        """
+        :param origin: (x, y) of the lower left corner of the lattice
+        :param side: side of a cell
+        :param nrows: number of rows (along y)
+        :param ncols: number of columns (along x)
+        :param crs: string of the crs
+        :param cells: array-like of flat cell ids of active cells, default None (all cells are active)
+        """
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.side = float(side)
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.crs = crs
+        if cells is None:
+            cells = np.arange(self.n_cells)
+        cells = np.asarray(cells, dtype=np.int64)
+        if (np.diff(cells) <= 0).any():
+            raise ValueError('cells should be strictly increasing (row by row, west to east)')
+        if len(cells) and (cells[0] < 0 or cells[-1] >= self.n_cells):
+            raise ValueError('cells out of the lattice of %d x %d' % (self.nrows, self.ncols))
+        self.cells = cells
+        # flat cell id -> spu index, -1 for inactive cells
+        self.cell2spu = np.full(self.n_cells, -1, dtype=np.int64)
+        self.cell2spu[cells] = np.arange(len(cells))
+
+    @property
+    def n_cells(self):
+        return self.nrows * self.ncols
+
+    @property
+    def n_spu(self):
+        return len(self.cells)
+
+    @property
+    def active(self):
+        """bool mask of the lattice, shape=(nrows, ncols)"""
+        return (self.cell2spu >= 0).reshape(self.nrows, self.ncols)
+
+    @property
+    def bounds(self):
+        ox, oy = self.origin
+        return ox, oy, ox + self.ncols * self.side, oy + self.nrows * self.side
+
+    # ==========================
+    # index math
+    # ==========================
+    def rowcol(self, spu=None):
+        """row and col of spus, all spus if spu is None"""
+        cells = self.cells if spu is None else self.cells[spu]
+        return np.divmod(cells, self.ncols)
+
+    def centers(self, spu=None):
+        """
+        :param spu: array-like of spu index, default None (all spus)
+        :return: np.ndarray, shape=(n, 2), (x, y) of the centers
+        """
+        rows, cols = self.rowcol(spu)
+        ox, oy = self.origin
+        return np.column_stack([ox + (cols + 0.5) * self.side, oy + (rows + 0.5) * self.side])
+
+    def point_to_cell(self, x, y):
+        """flat cell id of points, -1 if the point is outside of the lattice"""
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        cols = np.floor((x - self.origin[0]) / self.side)
+        rows = np.floor((y - self.origin[1]) / self.side)
+        inside = (cols >= 0) & (cols < self.ncols) & (rows >= 0) & (rows < self.nrows)
+        cells = np.where(inside, rows * self.ncols + cols, -1)
+        return cells.astype(np.int64)
+
+    def point_to_spu(self, x, y):
+        """spu index of points, -1 if the point is not in any spu"""
+        cells = self.point_to_cell(x, y)
+        return np.where(cells >= 0, self.cell2spu[np.maximum(cells, 0)], -1)
+
+    def neighbors(self, kind='queen', spu=None):
+        """
+        :param kind: 'rook' (4 neighbors) or 'queen' (8 neighbors)
+        :param spu: array-like of spu index, default None (all spus)
+        :return: np.ndarray, shape=(n, 4 or 8), spu index of neighbors in the order of ROOK/QUEEN_OFFSETS,
+            -1 if the neighbor is out of the lattice or inactive
+        """
+        if kind == 'rook':
+            offsets = ROOK_OFFSETS
+        elif kind == 'queen':
+            offsets = QUEEN_OFFSETS
+        else:
+            raise ValueError('kind should be one of: rook, queen')
+        rows, cols = self.rowcol(spu)
+        nbrs = np.full((len(rows), len(offsets)), -1, dtype=np.int64)
+        for k, (dr, dc) in enumerate(offsets):
+            r, c = rows + dr, cols + dc
+            inside = (r >= 0) & (r < self.nrows) & (c >= 0) & (c < self.ncols)
+            nbrs[inside, k] = self.cell2spu[r[inside] * self.ncols + c[inside]]
+        return nbrs
+
+    def to_raster(self, values, fill=np.nan):
+        """spu values -> raster of shape (nrows, ncols), row 0 is the southmost row"""
+        values = np.asarray(values)
+        raster = np.full(self.n_cells, fill, dtype=np.result_type(values, type(fill)))
+        raster[self.cells] = values
+        return raster.reshape(self.nrows, self.ncols)
+
+    def from_raster(self, raster):
+        """raster of shape (nrows, ncols) -> spu values"""
+        raster = np.asarray(raster)
+        if raster.shape != (self.nrows, self.ncols):
+            raise ValueError('raster shape %s != (%d, %d)' % (raster.shape, self.nrows, self.ncols))
+        return raster.ravel()[self.cells]
+
+    # ==========================
+    # geometry related
+    # ==========================
+    def to_gdf(self):
+        """rebuild the grids as gp.GeoDataFrame, same columns as get_grids() except COL.area is not clipped"""
+        import geopandas as gp
+        import shapely
+
+        rows, cols = self.rowcol()
+        ox, oy = self.origin
+        x0, y0 = ox + cols * self.side, oy + rows * self.side
+        grids = gp.GeoDataFrame(geometry=shapely.box(x0, y0, x0 + self.side, y0 + self.side), crs=self.crs)
+        grids[C.COL.center] = list(map(tuple, self.centers().tolist()))
+        grids[C.COL.area] = self.side ** 2
+        return grids
+
+    @classmethod
+    def from_grids(cls, grids, side=None):
+        """infer the lattice from grids built by get_grids(), the spu index order should be row by row
+
+        :param grids: gp.GeoDataFrame of square grids
+        :param side: side of the grids, default None (inferred from the first grid)
+        """
+        import shapely
+
+        geoms = np.asarray(grids.geometry.values)
+        bounds = shapely.bounds(geoms)
+        if side is None:
+            side = bounds[0, 2] - bounds[0, 0]
+        minx, miny = bounds[:, 0].min(), bounds[:, 1].min()
+        maxx, maxy = bounds[:, 2].max(), bounds[:, 3].max()
+        ncols = int(round((maxx - minx) / side))
+        nrows = int(round((maxy - miny) / side))
+        cols = np.round((bounds[:, 0] - minx) / side).astype(np.int64)
+        rows = np.round((bounds[:, 1] - miny) / side).astype(np.int64)
+        crs = grids.crs.to_string() if hasattr(grids.crs, 'to_string') else grids.crs
+        return cls((minx, miny), side, nrows, ncols, crs=crs, cells=rows * ncols + cols)
+
+    # ==========================
+    # io
+    # ==========================
+    def to_dict(self):
+        # active cells are stored as runs of [start, length], a few runs per row
+        breaks = np.flatnonzero(np.diff(self.cells) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        lengths = np.diff(np.concatenate([starts, [len(self.cells)]]))
+        runs = np.column_stack([self.cells[starts], lengths]) if len(self.cells) else np.empty((0, 2))
+        return {'origin': list(self.origin), 'side': self.side, 'nrows': self.nrows, 'ncols': self.ncols,
+                'crs': self.crs, 'runs': runs.astype(int).tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        cells = [np.arange(s, s + n) for s, n in d['runs']]
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        return cls(d['origin'], d['side'], d['nrows'], d['ncols'], crs=d.get('crs'), cells=cells)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def main():
+    from shapely.geometry import Point
+    from src.utils.spatial_unit import get_grids
+
+    grids = get_grids(Point(0, 0).buffer(1000), 200)
+    spec = GridSpec.from_grids(grids)
+    print(spec)
+    print(spec.centers()[:5], grids[C.COL.center].head().tolist())
+    print(spec.point_to_spu([0, 950, 5000], [0, 0, 0]))
+    print(spec.neighbors('rook')[:5])
+    print(GridSpec.from_dict(spec.to_dict()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# coding=utf-8
+import json
+
+import numpy as np
+
+from src import constants as C
+
+SQRT3 = np.sqrt(3)
+# axial (dq, dr) of the 6 neighbors of a flat-top hexagon, counterclockwise from east-northeast
+HEX_OFFSETS = ((1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1))
+
+
+class HexSpec:
+    """Flat-top hexagonal tessellation in axial coordinates, index math without geometry
+
+    The center of hexagon (q, r) is (ox + 1.5 * side * q, oy + sqrt(3) * side * (r + q / 2)).
+    Hexagons are numbered in the bounding range q in [qmin, qmin + nq), r in [rmin, rmin + nr):
+    cell = (q - qmin) * nr + (r - rmin). Only active cells are spatial units;
+    the spu index of an active cell is its rank among active cells.
+    Same API as GridSpec: centers, point_to_cell, point_to_spu, neighbors, to_gdf, save/load.
+
+    Attributes
+    ----------
+    origin: (x, y) of the center of hexagon (0, 0)
+    side: side (= circumradius) of the hexagon, in the unit of the crs
+    qmin, rmin, nq, nr: bounding range of the axial coordinates
+    crs: string of the crs, e.g. 'EPSG:3559'
+    cells: np.ndarray of int64, flat cell id of each spu, sorted
+    """
+
+    def __str__(self):
+        return ('HexSpec(origin={}, side={}, q=[{}, {}), r=[{}, {}), crs={}, #spu={})'
+                ''.format(self.origin, self.side, self.qmin, self.qmin + self.nq, self.rmin, self.rmin + self.nr,
+                          self.crs, self.n_spu))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, origin, side, qmin, rmin, nq, nr, crs=None, cells=None):
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.side = float(side)
+        self.qmin, self.rmin = int(qmin), int(rmin)
+        self.nq, self.nr = int(nq), int(nr)
+        self.crs = crs
+        if cells is None:
+            cells = np.arange(self.n_cells)
+        cells = np.asarray(cells, dtype=np.int64)
+        if (np.diff(cells) <= 0).any():
+            raise ValueError('cells should be strictly increasing')
+        self.cells = cells
+        # flat cell id -> spu index, -1 for inactive cells
+        self.cell2spu = np.full(self.n_cells, -1, dtype=np.int64)
+        self.cell2spu[cells] = np.arange(len(cells))
+
+    @property
+    def n_cells(self):
+        return self.nq * self.nr
+
+    @property
+    def n_spu(self):
+        return len(self.cells)
+
+    @property
+    def area(self):
+        return 1.5 * SQRT3 * self.side ** 2
+
+    # ==========================
+    # index math
+    # ==========================
+    def qr(self, spu=None):
+        """axial coordinates of spus, all spus if spu is None"""
+        cells = self.cells if spu is None else self.cells[spu]
+        dq, dr = np.divmod(cells, self.nr)
+        return dq + self.qmin, dr + self.rmin
+
+    def _qr_to_cell(self, q, r):
+        dq, dr = q - self.qmin, r - self.rmin
+        inside = (dq >= 0) & (dq < self.nq) & (dr >= 0) & (dr < self.nr)
+        return np.where(inside, dq * self.nr + dr, -1).astype(np.int64)
+
+    def centers(self, spu=None):
+        """
+        :param spu: array-like of spu index, default None (all spus)
+        :return: np.ndarray, shape=(n, 2), (x, y) of the centers
+        """
+        q, r = self.qr(spu)
+        ox, oy = self.origin
+        return np.column_stack([ox + 1.5 * self.side * q, oy + SQRT3 * self.side * (r + q / 2)])
+
+    def point_to_qr(self, x, y):
+        """axial coordinates of the hexagons containing the points, by cube rounding"""
+        x = (np.asarray(x, dtype=float) - self.origin[0]) / self.side
+        y = (np.asarray(y, dtype=float) - self.origin[1]) / self.side
+        fq = 2 / 3 * x
+        fr = -1 / 3 * x + SQRT3 / 3 * y
+        fs = -fq - fr
+        q, r, s = np.round(fq), np.round(fr), np.round(fs)
+        dq, dr, ds = np.abs(q - fq), np.abs(r - fr), np.abs(s - fs)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        q = np.where(fix_q, -r - s, q)
+        r = np.where(fix_r, -q - s, r)
+        return q.astype(np.int64), r.astype(np.int64)
+
+    def point_to_cell(self, x, y):
+        """flat cell id of points, -1 if the point is outside of the bounding range"""
+        return self._qr_to_cell(*self.point_to_qr(x, y))
+
+    def point_to_spu(self, x, y):
+        """spu index of points, -1 if the point is not in any spu"""
+        cells = self.point_to_cell(x, y)
+        return np.where(cells >= 0, self.cell2spu[np.maximum(cells, 0)], -1)
+
+    def neighbors(self, kind=None, spu=None):
+        """
+        :param kind: not used, hexagons have 6 edge neighbors. For API consistency with GridSpec
+        :param spu: array-like of spu index, default None (all spus)
+        :return: np.ndarray, shape=(n, 6), spu index of neighbors in the order of HEX_OFFSETS, -1 if inactive
+        """
+        q, r = self.qr(spu)
+        nbrs = np.full((len(q), len(HEX_OFFSETS)), -1, dtype=np.int64)
+        for k, (dq, dr) in enumerate(HEX_OFFSETS):
+            cells = self._qr_to_cell(q + dq, r + dr)
+            nbrs[:, k] = np.where(cells >= 0, self.cell2spu[np.maximum(cells, 0)], -1)
+        return nbrs
+
+    # ==========================
+    # geometry related
+    # ==========================
+    def polygons(self, spu=None):
+        """np.ndarray of shapely Polygons of spus"""
+        import shapely
+
+        centers = self.centers(spu)
+        angles = np.deg2rad(np.arange(0, 360, 60))
+        ring = self.side * np.column_stack([np.cos(angles), np.sin(angles)])
+        coords = centers[:, None, :] + ring[None, :, :]
+        return shapely.polygons(coords)
+
+    def to_gdf(self):
+        """the hexagons as gp.GeoDataFrame, columns: geometry, COL.center, COL.area (not clipped)"""
+        import geopandas as gp
+
+        hexes = gp.GeoDataFrame(geometry=self.polygons(), crs=self.crs)
+        hexes[C.COL.center] = list(map(tuple, self.centers().tolist()))
+        hexes[C.COL.area] = self.area
+        return hexes
+
+    @classmethod
+    def covering(cls, shape, side, crs=None):
+        """hexagons intersecting shape, origin at the lower left corner of shape's bounds
+
+        :param shape: shapely geometry
+        :param side: side of the hexagon
+        :param crs: string of the crs
+        """
+        import shapely
+
+        minx, miny, maxx, maxy = shape.bounds
+        qmax = int(np.ceil((maxx - minx) / (1.5 * side))) + 1
+        qmin = -1
+        # r + q / 2 spans the height
+        rmin = int(np.floor(-qmax / 2)) - 1
+        rmax = int(np.ceil((maxy - miny) / (SQRT3 * side) - qmin / 2)) + 1
+        full = cls((minx, miny), side, qmin, rmin, qmax - qmin + 1, rmax - rmin + 1, crs=crs)
+        shapely.prepare(shape)
+        keep = shapely.intersects(shape, full.polygons())
+        return cls(full.origin, side, qmin, rmin, full.nq, full.nr, crs=crs, cells=full.cells[keep])
+
+    # ==========================
+    # io
+    # ==========================
+    def to_dict(self):
+        # active cells are stored as runs of [start, length]
+        breaks = np.flatnonzero(np.diff(self.cells) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        lengths = np.diff(np.concatenate([starts, [len(self.cells)]]))
+        runs = np.column_stack([self.cells[starts], lengths]) if len(self.cells) else np.empty((0, 2))
+        return {'origin': list(self.origin), 'side': self.side, 'qmin': self.qmin, 'rmin': self.rmin,
+                'nq': self.nq, 'nr': self.nr, 'crs': self.crs, 'runs': runs.astype(int).tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        cells = [np.arange(s, s + n) for s, n in d['runs']]
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        return cls(d['origin'], d['side'], d['qmin'], d['rmin'], d['nq'], d['nr'], crs=d.get('crs'), cells=cells)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def main():
+    from shapely.geometry import Point
+
+    spec = HexSpec.covering(Point(0, 0).buffer(1000), 100)
+    print(spec)
+    centers = spec.centers()
+    print(centers[:3])
+    print((spec.point_to_spu(centers[:, 0], centers[:, 1]) == np.arange(spec.n_spu)).all())
+    print(spec.neighbors()[:3])
+
+
+if __name__ == '__main__':
+    main()
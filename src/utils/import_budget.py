@@ -0,0 +1,111 @@
+# coding=utf-8
+"""Import time of src modules against a per-module budget
+
+usage (from the repo root):
+
+    python -m src.utils.import_budget [module ...]
+
+Each module is imported in a fresh interpreter, after numpy and pandas (which every module needs anyway),
+so the time is what the module itself adds to the startup of a CLI run or a worker process.
+Heavy dependencies (LAZY_DEPENDENCIES) should be imported inside the functions that use them:
+a module that pulls one of them at import time fails the check whatever its time.
+Exit code 1 if a module is over budget or imports a lazy dependency.
+"""
+import json
+import os
+import subprocess
+import sys
+
+# modules imported before the measured module, not counted
+BASELINE = ('numpy', 'pandas')
+# imported inside the functions that use them, never at module import
+LAZY_DEPENDENCIES = ('geopandas', 'shapely', 'pyproj', 'sklearn', 'folium', 'scipy', 'matplotlib')
+# module -> seconds on top of BASELINE
+IMPORT_BUDGETS = {
+    'src.exp_helper': 0.15,
+    'src.e0_load_tr_de_spu': 0.1,
+    'src.e1_compile_data': 0.15,
+    'src.xy_gen': 0.05,
+    'src.utils': 0.02,
+    'src.utils.data_prep': 0.05,
+    'src.utils.spatial_unit': 0.05,
+    'src.utils.metric_single_num': 0.05,
+    'src.model.bsln_kde': 0.05,
+    'src.model.bsln_bower': 0.05,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_importtime(stderr, after):
+    """(name, self seconds, cumulative seconds) of the -X importtime lines logged after the top-level import `after`"""
+    rows, started = [], False
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        if started:
+            rows.append((name.strip(), int(self_us) / 1e6, int(cum_us) / 1e6))
+        elif name.rstrip() == ' ' + after:
+            started = True
+    return rows
+
+
+def measure(module, repeat=3):
+    """import time of module in fresh interpreters
+
+    :param module: dotted name of the module
+    :param repeat: number of interpreters, the fastest run is kept
+    :return: dict, seconds: import time on top of BASELINE, lazy: lazy dependencies imported,
+        slowest: [(name, self seconds)] of the 3 slowest modules imported with it
+    """
+    code = ('import json, sys, time\n'
+            'import {baseline}\n'
+            't = time.perf_counter()\n'
+            'import {module}\n'
+            'seconds = time.perf_counter() - t\n'
+            'print(json.dumps([seconds, [m for m in {lazy!r} if m in sys.modules]]))'
+            ).format(baseline=', '.join(BASELINE), module=module, lazy=LAZY_DEPENDENCIES)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            raise ImportError('importing %s failed:\n%s' % (module, out.stderr.strip().splitlines()[-1]))
+        seconds, lazy = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or seconds < best['seconds']:
+            rows = sorted(parse_importtime(out.stderr, BASELINE[-1]), key=lambda r: -r[1])
+            best = {'seconds': seconds, 'lazy': lazy, 'slowest': [(name, s) for name, s, _ in rows[:3]]}
+    return best
+
+
+def check(modules=None, verbose=1):
+    """measure modules against IMPORT_BUDGETS
+
+    :param modules: list of modules, default None (all modules of IMPORT_BUDGETS)
+    :return: list of the modules failing the check
+    """
+    failed = []
+    for module in modules or IMPORT_BUDGETS:
+        m = measure(module)
+        budget = IMPORT_BUDGETS.get(module)
+        ok = not m['lazy'] and (budget is None or m['seconds'] <= budget)
+        if not ok:
+            failed.append(module)
+        if verbose:
+            print('{:<30} {:>7.3f}s  budget {:>6}  {:<4}  lazy deps imported: {:<12} slowest: {}'.format(
+                module, m['seconds'], '%.3fs' % budget if budget is not None else '-', 'ok' if ok else 'FAIL',
+                ','.join(m['lazy']) or '-', ', '.join('%s %.3fs' % s for s in m['slowest'])))
+    return failed
+
+
+def main():
+    failed = check(sys.argv[1:] or None)
+    if failed:
+        print('over budget or importing lazy dependencies: %s' % ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
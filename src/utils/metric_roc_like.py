@@ -146,9 +146,17 @@ def prediction_accuracy_index_upct(spatial_unit_attr):
                       upct_or_rbin='upct')
 
 
-def area_to_perimeter_ratio_upct(spatial_unit_attr, upct_or_rbin='upct'):
-    """Proposed by bower-2004"""
-    from shapely.ops import cascaded_union
+def area_to_perimeter_ratio_upct(spatial_unit_attr, upct_or_rbin='upct', adjacency=None):
+    """Proposed by bower-2004
+
+    :param spatial_unit_attr: pd.DataFrame, columns: at least risk, area and geometry
+    :param upct_or_rbin: 'upct' or 'rbin'
+    :param adjacency: scipy.sparse matrix of shared boundary lengths between the rows of spatial_unit_attr,
+        see src.utils.spu_adjacency. If given, the perimeter of the union of the top units is
+        sum(perimeters) - shared boundaries, instead of computing the union.
+    """
+    import numpy as np
+    import shapely
     # upct index
     # num_grids = len(spatial_unit_attr)
     # idx_for_upct = [int(num_grids * (i + 1) / 10) for i in range(9)] + [num_grids - 1]
@@ -156,17 +164,29 @@ def area_to_perimeter_ratio_upct(spatial_unit_attr, upct_or_rbin='upct'):
     num = 5 if upct_or_rbin == 'rbin' else 10
     iloc_idx, readable_idx = get_idx(spatial_unit_attr, num, upct_or_rbin)
 
-    tmp = spatial_unit_attr.sort_values(C.COL.risk, ascending=False)
+    order = np.argsort(-spatial_unit_attr[C.COL.risk].values, kind='stable')
+    tmp = spatial_unit_attr.iloc[order].copy()
     tmp['cum_area'] = tmp[C.COL.area].cumsum()
 
+    if adjacency is not None:
+        # a shared boundary is inside the union once both of its units are in
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        adj = adjacency.tocoo()
+        shared = np.bincount(np.maximum(rank[adj.row], rank[adj.col]), weights=adj.data, minlength=len(order))
+        # adjacency is symmetric, each shared boundary is counted twice, once per unit
+        cum_perimeter = np.cumsum(shapely.length(np.asarray(tmp['geometry'].values)) - shared)
+
     res = []
     for idx, name in zip(iloc_idx, readable_idx):
-        sub_units = tmp.iloc[:idx + 1]['geometry']
-        perimeter = cascaded_union(sub_units).length
+        if adjacency is not None:
+            perimeter = cum_perimeter[idx]
+        else:
+            sub_units = tmp.iloc[:idx + 1]['geometry']
+            perimeter = shapely.union_all(np.asarray(sub_units.values)).length
         cum_area = tmp.iloc[idx]['cum_area']
         res.append(cum_area / perimeter)
         # print(idx, cum_area, perimeter)
-        # print(cascaded_union(sub_units).wkt)
 
     return pd.Series(res, index=readable_idx)
 
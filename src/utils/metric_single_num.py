@@ -1,4 +1,3 @@
-from sklearn.metrics import mean_absolute_error, r2_score, auc, mean_squared_error
 from math import sqrt
 from . import p2f
 import numpy as np
@@ -30,18 +29,22 @@ def prediction_accuracy_index(y_true, y_pred, spu):
 
 
 def rmse(y_true, y_pred, spu=None):
+    from sklearn.metrics import mean_squared_error
     return sqrt(mean_squared_error(y_true, y_pred))
 
 
 def mae(y_true, y_pred, spu=None):
+    from sklearn.metrics import mean_absolute_error
     return mean_absolute_error(y_true, y_pred)
 
 
 def r2(y_true, y_pred, spu=None):
+    from sklearn.metrics import r2_score
     return r2_score(y_true, y_pred)
 
 
 def curve2auc(curve):
+    from sklearn.metrics import auc
     x = curve.reset_index()['index'].apply(p2f)
     y = curve.values
     return auc(x, y)
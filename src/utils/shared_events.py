@@ -0,0 +1,176 @@
+# coding=utf-8
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from src.constants import COL
+from src.utils.event_cube import to_ns
+
+# picklable description of a SharedEventStore, pass it to workers instead of the data
+SharedEventHandle = namedtuple('SharedEventHandle', ['name', 'n_events', 'layout', 'categories'])
+
+# column of the store -> dtype
+SHARED_COLUMNS = (('times', 'int64'), ('x', 'float64'), ('y', 'float64'), ('category', 'int32'), ('spu', 'int32'))
+
+
+class SharedEventStore:
+    """Compact columns of an event table in one multiprocessing.shared_memory block
+
+    The owner process copies times (int64 ns, sorted), x, y, category codes and spu ids into the block once.
+    Workers attach by the picklable handle and get read-only numpy views of the same memory,
+    so starting workers costs neither pickling nor extra RAM per worker.
+
+    >>> store = SharedEventStore.create(data)
+    >>> with ProcessPoolExecutor(32) as pool:
+    ...     results = list(pool.map(work, [store.handle] * 32, periods))
+    >>> store.unlink()
+
+    where work(handle, period) starts with `store = SharedEventStore.attach(handle)`.
+
+    Attributes
+    ----------
+    handle: SharedEventHandle
+    times: np.ndarray of int64 nanoseconds, sorted
+    x, y: np.ndarray of float64, coordinates in the crs of the spatial units
+    category: np.ndarray of int32, code of categories[code], -1 if missing
+    spu: np.ndarray of int32, spu id, -1 if the event is in no spu
+    categories: list of categories
+    """
+
+    def __str__(self):
+        return 'SharedEventStore(name={}, #events={}, #categories={}, owner={})'.format(
+            self.handle.name, self.handle.n_events, len(self.categories), self.owner)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, shm, handle, owner):
+        self._shm = shm
+        self.handle = handle
+        self.owner = owner
+        self.categories = list(handle.categories)
+        for col, dtype, offset in handle.layout:
+            arr = np.ndarray(handle.n_events, dtype=dtype, buffer=shm.buf, offset=offset)
+            arr.flags.writeable = owner
+            setattr(self, col, arr)
+
+    @classmethod
+    def create(cls, data, name=None):
+        """copy the compact columns of an event table into a new shared memory block
+
+        :param data: pd.DataFrame indexed by DateTime, with columns COL.x, COL.y, COL.category, COL.spu
+            (the compact event schema of load_crime/load_911)
+        :param name: name of the block, default None (a random name)
+        """
+        from multiprocessing import shared_memory
+
+        times = to_ns(data.index)
+        order = np.argsort(times, kind='stable')
+        codes, categories = pd.factorize(data[COL.category], sort=True)
+        spu = pd.to_numeric(data[COL.spu]).astype('float64').to_numpy(na_value=np.nan)
+        columns = {'times': times, 'x': np.asarray(data[COL.x], dtype=float), 'y': np.asarray(data[COL.y], dtype=float),
+                   'category': codes, 'spu': np.where(np.isnan(spu), -1, spu)}
+
+        layout, offset = [], 0
+        for col, dtype in SHARED_COLUMNS:
+            layout.append((col, dtype, offset))
+            # keep every column 8-byte aligned
+            offset += -(-len(data) * np.dtype(dtype).itemsize // 8) * 8
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+        handle = SharedEventHandle(shm.name, len(data), tuple(layout), tuple(categories))
+        store = cls(shm, handle, owner=True)
+        for col, dtype in SHARED_COLUMNS:
+            getattr(store, col)[:] = np.asarray(columns[col])[order].astype(dtype)
+        return store
+
+    @classmethod
+    def attach(cls, handle):
+        """read-only store of a block created by another process"""
+        from multiprocessing import shared_memory
+
+        # workers started by the owner share its resource tracker, only the owner unlinks the block
+        return cls(shared_memory.SharedMemory(name=handle.name), handle, owner=False)
+
+    def __len__(self):
+        return self.handle.n_events
+
+    def rows(self, sd, ed):
+        """slice of the events in [sd, ed], sd and ed are datetime-like.
+        As in EventCube.day_bounds, a date string ed ('%Y-%m-%d') includes the whole day"""
+        a = np.searchsorted(self.times, pd.Timestamp(sd).as_unit('ns').value, side='left')
+        if isinstance(ed, str) and len(ed) == len('2018-01-01'):
+            end = (pd.Timestamp(ed) + pd.Timedelta(days=1)).as_unit('ns').value
+            b = np.searchsorted(self.times, end, side='left')
+        else:
+            b = np.searchsorted(self.times, pd.Timestamp(ed).as_unit('ns').value, side='right')
+        return slice(int(a), int(b))
+
+    def count(self, sd, ed, n_spu, categories=None):
+        """number of events in [sd, ed] per spu id, np.ndarray of shape (n_spu,)
+
+        :param categories: list of categories, default None (all categories)
+        """
+        rows = self.rows(sd, ed)
+        spu, keep = self.spu[rows], self.spu[rows] >= 0
+        if categories is not None:
+            codes = [self.categories.index(c) for c in categories if c in self.categories]
+            keep &= np.isin(self.category[rows], codes)
+        return np.bincount(spu[keep], minlength=n_spu)
+
+    def to_frame(self):
+        """the events as a pd.DataFrame (a copy), in the compact event schema"""
+        return pd.DataFrame({COL.x: self.x.copy(), COL.y: self.y.copy(),
+                             COL.category: pd.Categorical.from_codes(self.category, self.categories),
+                             COL.spu: pd.arrays.IntegerArray(self.spu.copy(), self.spu < 0)},
+                            index=pd.DatetimeIndex(self.times.astype('datetime64[ns]'), name=COL.datetime))
+
+    def close(self):
+        """detach this process from the block"""
+        # drop the views before closing the buffer they point to
+        for col, _ in SHARED_COLUMNS:
+            setattr(self, col, None)
+        self._shm.close()
+
+    def unlink(self):
+        """free the block, by the owner once every worker is done"""
+        self.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+
+def _count_worker(handle, sd, ed, n_spu):
+    store = SharedEventStore.attach(handle)
+    cnt = store.count(sd, ed, n_spu)
+    store.close()
+    return cnt
+
+
+def main():
+    from concurrent.futures import ProcessPoolExecutor
+
+    n = 10 ** 5
+    idx = pd.Timestamp('2015-01-01') + pd.to_timedelta(np.sort(np.random.randint(0, 365 * 86400, n)), unit='s')
+    data = pd.DataFrame({COL.x: np.random.rand(n), COL.y: np.random.rand(n),
+                         COL.category: np.random.choice(['a', 'b'], n),
+                         COL.spu: np.random.randint(0, 100, n)}, index=idx)
+    with SharedEventStore.create(data) as store:
+        print(store)
+        windows = [('2015-%02d-01' % m, '2015-%02d-28' % m) for m in range(1, 13)]
+        with ProcessPoolExecutor(4) as pool:
+            cnts = list(pool.map(_count_worker, *zip(*[(store.handle, sd, ed, 100) for sd, ed in windows])))
+        print([c.sum() for c in cnts])
+        print((cnts[0] == store.count(*windows[0], n_spu=100)).all())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,30 @@
 import os
+from functools import lru_cache
 
-import geopandas as gp
+import numpy as np
 import pandas as pd
 
 from src import constants as C
-from src.e0_load_tr_de_spu import get_spu
+from src.e0_load_tr_de_spu import get_spu, get_spu_path, get_grid_spec_path, get_hex_spec_path
+from src.utils.grid_spec import GridSpec
+from src.utils.hex_spec import HexSpec
 
 
 def get_grids(shape, grid_side=200, crs=None):
-    from shapely.geometry import Polygon, LineString, box
-    import numpy as np
+    """build square grids covering shape, vectorized with shapely 2 array functions
+
+    Grids are ordered row by row (south to north), west to east within a row.
+
+    :param shape: bbox tuple (minx, miny, maxx, maxy), closed LineString or Polygon
+    :param grid_side: side of the grid, in the unit of the crs
+    :param crs: crs of the returned grids
+    :return: gp.GeoDataFrame with columns geometry, COL.center and COL.area.
+        If shape is not a bbox, only grids intersecting shape are kept,
+        and COL.area is the area of the grid within shape
+    """
+    import geopandas as gp
+    import shapely
+    from shapely.geometry import Polygon, LineString
 
     # if shape is tuple, set it to false
     do_intersect = True
@@ -31,76 +46,218 @@ def get_grids(shape, grid_side=200, crs=None):
     else:
         raise ValueError('shape is not bbox tuple, closed LineString or Polygon')
 
-    grid_lon, grid_lat = np.mgrid[lon_min:lon_max + grid_side:grid_side, lat_min:lat_max + grid_side:grid_side]
-    grids_poly = []
-
-    for j in range(grid_lat.shape[1] - 1):
-        for i in range(grid_lon.shape[0] - 1):
-            g = box(grid_lon[i, j], grid_lat[i, j], grid_lon[i + 1, j + 1], grid_lat[i + 1, j + 1])
-            if do_intersect and not g.intersects(shape):
-                continue
-            grids_poly.append(g)
+    # same break points as np.mgrid[lon_min:lon_max + grid_side:grid_side, ...]
+    xs = np.arange(lon_min, lon_max + grid_side, grid_side)
+    ys = np.arange(lat_min, lat_max + grid_side, grid_side)
+    x0, y0 = [a.ravel() for a in np.meshgrid(xs[:-1], ys[:-1])]
+    x1, y1 = [a.ravel() for a in np.meshgrid(xs[1:], ys[1:])]
+    boxes = shapely.box(x0, y0, x1, y1)
+    areas = shapely.area(boxes)
 
-    grids = gp.GeoDataFrame(grids_poly).rename(columns={0: 'geometry'})
-    grids[C.COL.center] = grids.geometry.apply(lambda x: x.centroid.coords[0])
-    if crs is not None:
-        # for unknown reason, sometimes grids.crs is not set by assigning once
-        while grids.crs is None:
-            grids.crs = crs
+    if do_intersect:
+        shapely.prepare(shape)
+        keep = shapely.intersects(shape, boxes)
+        boxes, areas = boxes[keep], areas[keep]
+        x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+        # only boundary grids need clipping, grids within shape keep the full area
+        boundary = ~shapely.contains_properly(shape, boxes)
+        areas[boundary] = shapely.area(shapely.intersection(boxes[boundary], shape))
 
-    grids[C.COL.area] = grids.geometry.apply(lambda x: x.area)
+    grids = gp.GeoDataFrame(geometry=boxes, crs=crs)
+    grids[C.COL.center] = list(zip(((x0 + x1) / 2).tolist(), ((y0 + y1) / 2).tolist()))
+    grids[C.COL.area] = areas
     return grids
 
 
 def baltimore_grids(grid_side=200, cityline_path=None):
+    import geopandas as gp
+
     if cityline_path is None:
-        cityline_path = C.Path_shape.cityline
+        cityline_path = C.PathShape.cityline
     cityline = gp.read_file(cityline_path)
     cityline = cityline.to_crs(epsg=3559)
     grids = get_grids(cityline.geometry[0], grid_side, crs=cityline.crs)
     return grids
 
 
-def get_grid2nbh_ratio(grid_name, nbh_name, to_csv=False):
-    grid = get_spu(grid_name)
-    nbh_all = get_spu(nbh_name)
-    joined = gp.sjoin(grid, nbh_all)
-    pairs = joined['index_right'].reset_index()
-    num_bh_per_grid = pairs.groupby('index').size()
-    ratio = pairs[pairs['index'].isin(num_bh_per_grid[num_bh_per_grid == 1].index)].copy()
-    ratio.columns = ['grid', 'nbh']
-    ratio['ratio'] = 1
-    more_ratio = []
-    for gidx in num_bh_per_grid[num_bh_per_grid != 1].index:
-        g = grid.loc[gidx].geometry
-        garea = g.area
-        for nbhidx in pairs[pairs['index'] == gidx].index_right.values:
-            nbh = nbh_all.loc[nbhidx].geometry
-            more_ratio.append({'grid': gidx, 'nbh': nbhidx, 'ratio': g.intersection(nbh).area / garea})
-    #     break
-    more_ratio_df = pd.DataFrame(more_ratio)
-    ratio = ratio.append(more_ratio_df, ignore_index=True)
+def get_hexes(shape, hex_side=200, crs=None):
+    """build flat-top hexagons covering shape
+
+    :param shape: shapely geometry
+    :param hex_side: side of the hexagon, in the unit of the crs
+    :param crs: crs of the returned hexagons
+    :return: (gp.GeoDataFrame with columns geometry, COL.center and COL.area clipped by shape, HexSpec)
+    """
+    import shapely
+
+    crs_str = crs.to_string() if hasattr(crs, 'to_string') else crs
+    spec = HexSpec.covering(shape, hex_side, crs=crs_str)
+    hexes = spec.to_gdf()
+    geoms = np.asarray(hexes.geometry.values)
+    boundary = ~shapely.contains_properly(shape, geoms)
+    areas = hexes[C.COL.area].values.copy()
+    areas[boundary] = shapely.area(shapely.intersection(geoms[boundary], shape))
+    hexes[C.COL.area] = areas
+    return hexes, spec
+
+
+def baltimore_hexes(hex_side=200, cityline_path=None, to_file=True):
+    """hexagons clipped to the cityline, written to data/spu/hex_<side>.geojson with its HexSpec if to_file"""
+    import geopandas as gp
+
+    if cityline_path is None:
+        cityline_path = C.PathShape.cityline
+    cityline = gp.read_file(cityline_path)
+    cityline = cityline.to_crs(epsg=3559)
+    shape = cityline.geometry[0]
+    if shape.geom_type == 'LineString':
+        from shapely.geometry import Polygon
+        shape = Polygon(shape)
+    hexes, spec = get_hexes(shape, hex_side, crs=cityline.crs)
+    if to_file:
+        name = 'hex_%d' % hex_side
+        hexes.to_file(get_spu_path(name), driver='GeoJSON')
+        spec.save(get_hex_spec_path(name))
+    return hexes
+
+
+def get_hex_spec(hex_name):
+    """load the HexSpec stored next to the hexagon spu"""
+    return HexSpec.load(get_hex_spec_path(hex_name))
+
+
+def get_grid_spec(grid_name):
+    """load the GridSpec stored next to the grid spu; infer it from the geometry and store it if not exist"""
+    path = get_grid_spec_path(grid_name)
+    if os.path.exists(path):
+        return GridSpec.load(path)
+    spec = GridSpec.from_grids(get_spu(grid_name))
+    spec.save(path)
+    return spec
+
+
+def _intersection_ratio(src_geoms, tgt_geoms):
+    """area(src & tgt) / area(src), pairwise"""
+    import shapely
+    return shapely.area(shapely.intersection(src_geoms, tgt_geoms)) / shapely.area(src_geoms)
+
+
+def spu2spu_ratio(src, tgt, n_jobs=1, chunk_size=50000):
+    """the ratio of the area of each src unit that falls in each tgt unit
+
+    Candidate pairs come from a STRtree query; a src unit with only one candidate gets ratio 1,
+    the others get vectorized intersection areas, computed in parallel chunks if n_jobs > 1.
+
+    :param src: gp.GeoDataFrame, source spatial units
+    :param tgt: gp.GeoDataFrame, target spatial units, in the same crs as src
+    :param n_jobs: number of processes for intersection areas
+    :param chunk_size: number of pairs per chunk
+    :return: pd.DataFrame with columns src, tgt (index of src and tgt) and ratio, pairs with ratio 0 are dropped
+    """
+    import shapely
+
+    src_geoms = np.asarray(src.geometry.values)
+    tgt_geoms = np.asarray(tgt.geometry.values)
+    src_pos, tgt_pos = shapely.STRtree(tgt_geoms).query(src_geoms, predicate='intersects')
+
+    ratio = np.ones(len(src_pos))
+    num_tgt = np.bincount(src_pos, minlength=len(src_geoms))
+    multi = np.flatnonzero(num_tgt[src_pos] > 1)
+    chunks = [multi[i:i + chunk_size] for i in range(0, len(multi), chunk_size)]
+    args = [(src_geoms[src_pos[c]], tgt_geoms[tgt_pos[c]]) for c in chunks]
+    if n_jobs > 1 and len(chunks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(n_jobs) as pool:
+            ratios = list(pool.map(_intersection_ratio, *zip(*args)))
+    else:
+        ratios = [_intersection_ratio(*a) for a in args]
+    for c, r in zip(chunks, ratios):
+        ratio[c] = r
+
+    # pairs only touching each other have 0 area in common
+    keep = ratio > 0
+    return pd.DataFrame({'src': src.index.values[src_pos[keep]], 'tgt': tgt.index.values[tgt_pos[keep]],
+                         'ratio': ratio[keep]})
+
+
+def get_grid2nbh_ratio(grid_name, nbh_name, to_csv=False, n_jobs=1):
+    """spu2spu_ratio() of two named spus, works for any pair (e.g. grid->nbh, grid->grid, nbh->nbh)
+
+    :return: pd.DataFrame with columns grid, nbh and ratio
+    """
+    ratio = spu2spu_ratio(get_spu(grid_name), get_spu(nbh_name), n_jobs=n_jobs)
+    ratio.columns = ['grid', 'nbh', 'ratio']
     if to_csv:
-        ratio.to_csv('data/spu/%s_to_%s.csv' % (grid_name, nbh_name))
+        ratio.to_csv(get_grid2nbh_ratio_path(grid_name, nbh_name))
     return ratio
 
 
-def grid2nbh(grid_stats, grid_name='grid_50', nbh_name='bnia_nbh', kind='sum'):
-    path = 'data/spu/%s_to_%s.csv' % (grid_name, nbh_name)
+def get_grid2nbh_ratio_path(grid_name, nbh_name):
+    return C.PathShape.spu_dir + '%s_to_%s.csv' % (grid_name, nbh_name)
+
+
+@lru_cache(maxsize=None)
+def _grid2nbh_matrix(grid_name, nbh_name):
+    from scipy import sparse
+
+    path = get_grid2nbh_ratio_path(grid_name, nbh_name)
     if os.path.exists(path):
         ratio = pd.read_csv(path, index_col=0)
     else:
         ratio = get_grid2nbh_ratio(grid_name, nbh_name, to_csv=True)
-    # print(ratio)
-    stats = grid_stats.to_frame().merge(ratio, left_index=True, right_on='grid')
+    nbh_index = get_spu(nbh_name).index
+    # grids after the last one in the ratio intersect no nbh
+    n_grid = int(ratio['grid'].max()) + 1 if len(ratio) else 0
+    mat = sparse.csr_matrix((ratio['ratio'].values, (ratio['nbh'].values, ratio['grid'].values)),
+                            shape=(len(nbh_index), n_grid))
+    return mat, nbh_index
+
+
+def get_grid2nbh_matrix(grid_name='grid_50', nbh_name='bnia_nbh'):
+    """cached scipy.sparse.csr_matrix of shape (#nbh, #grid), [nbh, grid] = the ratio of the grid's area in nbh"""
+    return _grid2nbh_matrix(grid_name, nbh_name)[0]
+
+
+def grid2nbh(grid_stats, grid_name='grid_50', nbh_name='bnia_nbh', kind='sum'):
+    """aggregate grid statistics to neighborhoods, weighted by the ratio of grid area in each neighborhood
+
+    :param grid_stats: pd.Series indexed by grid index,
+        or 2-d np.ndarray/pd.DataFrame of shape (#periods, #grids), columns in the order of the grid index
+    :param grid_name: name of the grid spu
+    :param nbh_name: name of the neighborhood spu
+    :param kind: 'sum': weighted sum of the stats; 'count': weighted count of grids with stats > 0
+    :return: pd.Series indexed by nbh index if grid_stats is a pd.Series,
+        otherwise pd.DataFrame of shape (#periods, #nbh).
+        NaN for the nbhs without any grid (of grid_stats if it is a pd.Series)
+    """
+    mat, nbh_index = _grid2nbh_matrix(grid_name, nbh_name)
+    n_grid = mat.shape[1]
+
+    if isinstance(grid_stats, pd.Series):
+        grid_stats = grid_stats[grid_stats.index.values < n_grid]
+        values = np.zeros(n_grid)
+        values[grid_stats.index.values] = grid_stats.values
+        has_grid = np.zeros(n_grid)
+        has_grid[grid_stats.index.values] = 1
+        index = None
+    else:
+        index = grid_stats.index if isinstance(grid_stats, pd.DataFrame) else None
+        values = np.asarray(grid_stats, dtype=float)[..., :n_grid]
+        has_grid = np.ones(n_grid)
+    covered = (mat != 0).dot(has_grid) > 0
+
     if kind == 'count':
-        stats['stat'] = stats.iloc['stat'] > 1e-7
-    stats = stats.groupby('nbh').apply(lambda x: sum(x.stat * x.ratio))
-    return stats.reindex(get_spu(nbh_name).index)
+        values = (values > 1e-7).astype(float)
+    elif kind != 'sum':
+        raise ValueError('kind should be one of: sum, count')
+
+    if values.ndim == 1:
+        return pd.Series(np.where(covered, mat.dot(values), np.nan), index=nbh_index)
+    return pd.DataFrame(np.where(covered, mat.dot(values.T).T, np.nan), index=index, columns=nbh_index)
 
 
 def main():
-    grids = baltimore_grids(cityline_path='../' + C.Path_shape.cityline)
+    grids = baltimore_grids(cityline_path='../' + C.PathShape.cityline)
     # print(grids.head())
     print(pd.DataFrame([grids.Area, grids.Cen_coords]).T.head())
     a = grids.Area
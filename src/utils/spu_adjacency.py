@@ -0,0 +1,118 @@
+# coding=utf-8
+import os
+
+import numpy as np
+
+from src.utils.grid_spec import ROOK_OFFSETS, QUEEN_OFFSETS
+
+
+def grid_adjacency(spec, kind='rook'):
+    """adjacency of grids, derived arithmetically from the lattice
+
+    :param spec: GridSpec
+    :param kind: 'rook' (shared edges) or 'queen' (shared edges or corners)
+    :return: scipy.sparse.csr_matrix of shape (n_spu, n_spu), value=length of the shared boundary.
+        Queen neighbors sharing only a corner are stored as explicit 0.
+    """
+    from scipy import sparse
+
+    nbrs = spec.neighbors(kind)
+    offsets = ROOK_OFFSETS if kind == 'rook' else QUEEN_OFFSETS
+    lengths = np.array([spec.side if 0 in offset else 0. for offset in offsets])
+    rows, k = np.nonzero(nbrs >= 0)
+    return sparse.csr_matrix((lengths[k], (rows, nbrs[rows, k])), shape=(spec.n_spu, spec.n_spu))
+
+
+def hex_adjacency(spec):
+    """adjacency of hexagons, derived arithmetically from the axial coordinates
+
+    :param spec: HexSpec
+    :return: scipy.sparse.csr_matrix of shape (n_spu, n_spu), value=length of the shared edge
+    """
+    from scipy import sparse
+
+    nbrs = spec.neighbors()
+    rows, k = np.nonzero(nbrs >= 0)
+    return sparse.csr_matrix((np.full(len(rows), spec.side), (rows, nbrs[rows, k])), shape=(spec.n_spu, spec.n_spu))
+
+
+def polygon_adjacency(spu, kind='rook'):
+    """adjacency of polygons, from STRtree candidate pairs and vectorized shared boundary lengths
+
+    :param spu: gp.GeoDataFrame
+    :param kind: 'rook' (shared boundary length > 0) or 'queen' (any touching)
+    :return: scipy.sparse.csr_matrix of shape (n_spu, n_spu), value=length of the shared boundary.
+        Queen neighbors sharing only points are stored as explicit 0.
+    """
+    import shapely
+    from scipy import sparse
+
+    if kind not in ('rook', 'queen'):
+        raise ValueError('kind should be one of: rook, queen')
+    geoms = np.asarray(spu.geometry.values)
+    left, right = shapely.STRtree(geoms).query(geoms, predicate='intersects')
+    keep = left != right
+    left, right = left[keep], right[keep]
+    lengths = shapely.length(shapely.intersection(shapely.boundary(geoms[left]), shapely.boundary(geoms[right])))
+    if kind == 'rook':
+        keep = lengths > 0
+        left, right, lengths = left[keep], right[keep], lengths[keep]
+    return sparse.csr_matrix((lengths, (left, right)), shape=(len(geoms), len(geoms)))
+
+
+def get_adjacency_path(spu_name, kind):
+    from src.e0_load_tr_de_spu import SPU_REGISTRY
+    return os.path.join(os.path.dirname(SPU_REGISTRY.get_cache_path(spu_name)),
+                        'adjacency_%s_%s.npz' % (spu_name, kind))
+
+
+def get_adjacency(spu_name, kind='rook'):
+    """adjacency of a named spu, persisted next to the binary spu cache and invalidated by the geojson mtime.
+    Grids (spu_name starts with grid_) use grid_adjacency(), hexagons (hex_) use hex_adjacency(),
+    others use polygon_adjacency().
+
+    :return: scipy.sparse.csr_matrix, index in the order of the spu index
+    """
+    from scipy import sparse
+    from src.e0_load_tr_de_spu import get_spu, get_spu_path
+
+    path = get_adjacency_path(spu_name, kind)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(get_spu_path(spu_name)):
+        return sparse.load_npz(path)
+
+    if spu_name.startswith('grid_'):
+        from src.utils.spatial_unit import get_grid_spec
+        adj = grid_adjacency(get_grid_spec(spu_name), kind)
+    elif spu_name.startswith('hex_'):
+        # hexagons only share edges, rook == queen
+        from src.utils.spatial_unit import get_hex_spec
+        adj = hex_adjacency(get_hex_spec(spu_name))
+    else:
+        adj = polygon_adjacency(get_spu(spu_name), kind)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sparse.save_npz(path, adj)
+    return adj
+
+
+def binary(adj):
+    """0/1 weights with the same structure, keeping queen neighbors with 0 shared length"""
+    adj = adj.copy()
+    adj.data[:] = 1
+    return adj
+
+
+def spatial_lag(adj, values, row_standardize=True):
+    """weighted average (or sum) of the neighbors' values"""
+    if row_standardize:
+        from scipy import sparse
+        rsum = np.asarray(adj.sum(axis=1)).ravel()
+        rsum[rsum == 0] = 1
+        adj = sparse.diags(1 / rsum).dot(adj)
+    return adj.dot(np.asarray(values, dtype=float))
+
+
+def morans_i(adj, values):
+    """global Moran's I of values under weights adj"""
+    z = np.asarray(values, dtype=float)
+    z = z - z.mean()
+    return len(z) / adj.sum() * z.dot(adj.dot(z)) / z.dot(z)
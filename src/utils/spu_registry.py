@@ -0,0 +1,83 @@
+# coding=utf-8
+import os
+from collections import OrderedDict
+
+
+class SpuRegistry:
+    """Registry of spatial units with an in-process LRU cache and an on-disk binary cache
+
+    get(name) reads the spu from the in-process cache; on a miss it reads the GeoParquet cache
+    (cache_dir/name.parquet), and only parses the geojson if the binary cache is missing or older than the geojson.
+    Both caches are invalidated by the mtime of the geojson.
+    GeoParquet needs pyarrow; without it, the geojson is parsed on every miss.
+
+    Attributes
+    ----------
+    maxsize: max number of spus kept in process
+    cache_dir: directory of the binary cache
+    """
+
+    def __str__(self):
+        return 'SpuRegistry(maxsize={}, cache_dir={}, cached={})'.format(
+            self.maxsize, self.cache_dir, list(self._cache.keys()))
+
+    def __init__(self, path_func, maxsize=8, cache_dir=None, verbose=0):
+        """
+        :param path_func: callable, name -> path of the geojson of the spu
+        :param maxsize: max number of spus kept in process
+        :param cache_dir: directory of the binary cache, default: .cache/ next to the geojson
+        :param verbose: level of verbosity
+        """
+        self.path_func = path_func
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+        # name -> (mtime of geojson, gp.GeoDataFrame)
+        self._cache = OrderedDict()
+
+    def get_cache_path(self, name):
+        src = self.path_func(name)
+        cache_dir = self.cache_dir if self.cache_dir is not None else os.path.join(os.path.dirname(src), '.cache')
+        return os.path.join(cache_dir, os.path.basename(name) + '.parquet')
+
+    def get(self, name):
+        """
+        :param name: name of the spu
+        :return: gp.GeoDataFrame, a copy that the caller can modify
+        """
+        mtime = os.path.getmtime(self.path_func(name))
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == mtime:
+            self._cache.move_to_end(name)
+        else:
+            cached = (mtime, self._load(name, mtime))
+            self._cache[name] = cached
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return cached[1].copy()
+
+    def _load(self, name, mtime):
+        import geopandas as gp
+
+        cache_path = self.get_cache_path(name)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            if self.verbose:
+                print('pyarrow is not installed, reading spu %s from geojson' % name)
+            return gp.read_file(self.path_func(name))
+
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= mtime:
+            if self.verbose:
+                print('reading spu %s from binary cache %s' % (name, cache_path))
+            return gp.read_parquet(cache_path)
+
+        if self.verbose:
+            print('reading spu %s from geojson, writing binary cache %s' % (name, cache_path))
+        spu = gp.read_file(self.path_func(name))
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        spu.to_parquet(cache_path)
+        return spu
+
+    def clear(self):
+        self._cache.clear()
@@ -1,8 +1,56 @@
 import datetime
 import math
+
+import numpy as np
+import pandas as pd
+
 from src.utils import parse_date_str
 
 
+class RollingPlan:
+    """Periods of a Rolling compiled to row offsets of time-sorted datasets
+
+    Every period boundary is converted to int64 nanoseconds once; the offsets of a dataset come from
+    one np.searchsorted against its sorted time array. Each window is then a positional slice.
+
+    Attributes
+    ----------
+    dates: list of [past_sd, past_ed, pred_sd, pred_ed], as Rolling.roll()
+    bounds: np.ndarray of int64, shape=(#periods, 4), [past_sd, past_ed + 1ns, pred_sd, pred_ed + 1ns]
+    offsets: dict, key: name of a dataset, value: np.ndarray of int64, shape=(#periods, 4)
+        [past_start, past_stop, pred_start, pred_stop] row offsets, same inclusive semantics as .loc[sd:ed]
+    """
+
+    def __str__(self):
+        return 'RollingPlan(#periods={}, datasets={})'.format(len(self.dates), list(self.offsets.keys()))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __init__(self, dates):
+        self.dates = dates
+        bounds = pd.DatetimeIndex(np.ravel(dates) if dates else []).as_unit('ns').asi8
+        # .loc[sd:ed] includes ed: searching ed + 1ns on the left side = searching ed on the right side
+        self.bounds = bounds.reshape(-1, 4) + np.array([0, 1, 0, 1])
+        self.offsets = {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def add(self, name, times):
+        """compute the row offsets of a dataset
+
+        :param name: name of the dataset
+        :param times: sorted np.ndarray of int64 nanoseconds of the dataset
+        """
+        self.offsets[name] = np.searchsorted(times, self.bounds.ravel()).reshape(-1, 4)
+
+    def rows(self, name, period, past=True):
+        """slice of the rows of dataset name in the past (or pred) window of a period"""
+        start, stop = self.offsets[name][period, :2] if past else self.offsets[name][period, 2:]
+        return slice(int(start), int(stop))
+
+
 class Rolling:
     def __repr__(self):
         return self.__str__()
@@ -125,6 +173,10 @@ class Rolling:
             dates = [[str(d) for d in pairs] for pairs in dates]
         return dates
 
+    def compile(self):
+        """RollingPlan of self.roll(), add datasets to it with RollingPlan.add()"""
+        return RollingPlan(self.roll())
+
     def most_recent_period(self):
         dates = self.roll()
         if self.rback:
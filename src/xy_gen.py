@@ -1,6 +1,4 @@
-import geopandas as gp
 import pandas as pd
-from shapely.geometry import Point
 import numpy as np
 from src import constants as C
 from src.utils import str_is_float
@@ -11,16 +9,54 @@ def y_cnt_event(spatial_units, coords):
 
     :param spatial_units: gp.GeoDataFrame
     :param coords: pd.Series of coords, the coords should be in the same crs of spatial units
-    :return:
+    :return: pd.Series of float, index=spatial_units.index, name=COL.num_events.
+        With the spu assignment of the events or the spec of a grid, y_cnt_assigned and y_cnt_spec
+        count the same without a spatial join
     """
-    events = gp.GeoDataFrame(coords.apply(lambda x: Point(*x))).rename(columns={C.COL.coords: 'geometry'}).reset_index()
-    while events.crs is None and spatial_units.crs is not None:
-        events.crs = spatial_units.crs
+    import geopandas as gp
+
+    xy = np.array(coords.tolist(), dtype=float).reshape(-1, 2)
+    events = gp.GeoDataFrame(geometry=gp.points_from_xy(xy[:, 0], xy[:, 1]), crs=spatial_units.crs)
     joined = gp.sjoin(events, spatial_units)
     y_cnt = spatial_units.join(joined.groupby('index_right').size().rename(C.COL.num_events), how='left').fillna(0)
     return y_cnt[C.COL.num_events]
 
 
+def y_cnt_assigned(spatial_units, spus):
+    """same counts as y_cnt_event, from the spu assignment of the events (e.g. COL.spu of loaded data)
+    instead of a spatial join: one np.bincount of the positions of the spus
+
+    :param spatial_units: gp.GeoDataFrame or pd.DataFrame, only the index is used
+    :param spus: array-like, spu index of each event (an event in several spus appears once per spu).
+        NaN or spus not in spatial_units are not counted
+    :return: pd.Series of float, index=spatial_units.index, name=COL.num_events
+    """
+    positions = spatial_units.index.get_indexer(pd.Index(spus))
+    return _cnt_of_positions(spatial_units, positions)
+
+
+def y_cnt_spec(spatial_units, coords, spec):
+    """same counts as y_cnt_event for grids/hexagons, locating the events by the index math of spec
+    instead of building Points and a spatial join.
+    Unlike the spatial join, an event on the border of two spus is counted once
+
+    :param spatial_units: gp.GeoDataFrame of the spus of spec, in the order of spec (e.g. get_spu('grid_1000'))
+    :param coords: pd.Series of coords, in the crs of spec
+    :param spec: GridSpec or HexSpec
+    :return: pd.Series of float, index=spatial_units.index, name=COL.num_events
+    """
+    if len(spatial_units) != spec.n_spu:
+        raise ValueError('spatial units (%d) are not the spus of %s' % (len(spatial_units), spec))
+    xy = np.array(coords.tolist(), dtype=float).reshape(-1, 2)
+    return _cnt_of_positions(spatial_units, spec.point_to_spu(xy[:, 0], xy[:, 1]))
+
+
+def _cnt_of_positions(spatial_units, positions):
+    positions = np.asarray(positions)
+    cnt = np.bincount(positions[positions >= 0], minlength=len(spatial_units))
+    return pd.Series(cnt.astype(float), index=spatial_units.index, name=C.COL.num_events)
+
+
 def prepare_temporal_data_for_model(data, setting, spu=None):
     if setting == 'event_cnt':
         return event_cnt(data, spu=spu)
@@ -35,6 +71,65 @@ def prepare_temporal_data_for_model(data, setting, spu=None):
         raise NotImplementedError('No such setting:' + setting)
 
 
+def prepare_cnt_for_model(cnts, setting):
+    """same as prepare_temporal_data_for_model, for counts already computed (e.g. from an EventCube)
+
+    :param cnts: pd.DataFrame, index=spu index, columns=dnames
+    :param setting: event_cnt or hot_spot/kind
+    """
+    if setting == 'event_cnt':
+        return cnts
+    elif setting.startswith('hot_spot'):
+        if '/' not in setting:
+            raise ValueError('please specify the kind of hot spots with a /')
+        kind = setting.split('/')[1]
+        return hot_spot_cls(cnts, kind)
+    else:
+        raise NotImplementedError('No such setting for counts:' + setting)
+
+
+def cnt_matrix(data, spu_index=None, sparse=False):
+    """counts of events per spu (rows) and dname (columns), by a single np.bincount over
+    spu code * #dnames + dname code of the events of all dnames
+
+    :param data: dict
+        key: dname, value: dataframe with spu_assignment
+    :param spu_index: pd.Index, default None
+        rows of the matrix, in this order; events of other spus are not counted.
+        None: the spus with events, sorted
+    :param sparse: bool, default False
+        return a scipy.sparse.csr_matrix instead of a np.ndarray
+    :return: (matrix of int64 counts, pd.Index of the rows, list of the dnames of the columns)
+    """
+    dnames = list(data.keys())
+    columns = [df[C.COL.spu] for df in data.values()]
+    dtypes = set(c.dtype for c in columns)
+    spus = [c.to_numpy() for c in columns]
+    dname_codes = np.repeat(np.arange(len(dnames)), [len(s) for s in spus])
+    spus = np.concatenate(spus)
+    if spu_index is None:
+        spu_codes, spu_index = pd.factorize(spus, sort=True)
+        # the dtype of the spu column (e.g. Int32 with NA), as the index of groupby(COL.spu)
+        dtype = dtypes.pop() if len(dtypes) == 1 else None
+        if dtype is not None and not pd.api.types.is_object_dtype(dtype):
+            spu_index = pd.Index(spu_index, dtype=dtype, name=C.COL.spu)
+        else:
+            spu_index = pd.Index(spu_index, name=C.COL.spu).infer_objects()
+    else:
+        spu_codes = spu_index.get_indexer(spus)
+    # NaN or unknown spus
+    keep = spu_codes >= 0
+    spu_codes, dname_codes = spu_codes[keep], dname_codes[keep]
+    shape = (len(spu_index), len(dnames))
+
+    if sparse:
+        from scipy.sparse import coo_matrix
+        matrix = coo_matrix((np.ones(len(spu_codes), dtype=np.int64), (spu_codes, dname_codes)), shape=shape)
+        return matrix.tocsr(), spu_index, dnames
+    matrix = np.bincount(spu_codes * shape[1] + dname_codes, minlength=shape[0] * shape[1]).reshape(shape)
+    return matrix, spu_index, dnames
+
+
 def event_cnt(data, spu=None):
     """
 
@@ -46,15 +141,16 @@ def event_cnt(data, spu=None):
         index.name = constants.COL.spu
         columns = dnames
     """
-    cnts = []
-    # get a column per dname
-    for dname, df in data.items():
-        cnt = df.groupby(C.COL.spu).size()
-        cnt.name = dname
-        cnts.append(cnt)
-    cnts = pd.concat(cnts, axis=1)
-    if isinstance(cnts, pd.Series):
-        cnts = cnts.to_frame()
+    matrix, index, dnames = cnt_matrix(data)
+    # the frame of concatenating a groupby(spu).size() per dname: spus in order of appearance
+    # (the spus of the first dname, then the new ones of the next dnames),
+    # NaN where the dname has no event in the spu (float column)
+    first = (matrix > 0).argmax(axis=1)
+    order = np.lexsort((np.arange(len(index)), first))
+    matrix, index = matrix[order], index[order]
+    missing = (matrix == 0).any(axis=0)
+    cnts = pd.DataFrame({dname: np.where(matrix[:, i] > 0, matrix[:, i], np.nan) if missing[i] else matrix[:, i]
+                         for i, dname in enumerate(dnames)}, index=index)
 
     if spu is not None:
         cnts = cnts.reindex(spu.index).fillna(0)
@@ -69,14 +165,21 @@ def time_indexed_points(data):
     :return: dict
         key: dname, value: pd.Series of coords of points
     """
-    points = {dname: df[C.COL.coords] for dname, df in data.items()}
+    points = {dname: df[C.COL.coords] if C.COL.coords in df.columns else coords_from_xy(df)
+              for dname, df in data.items()}
     return points
 
 
+def coords_from_xy(df):
+    """pd.Series of (x, y) tuples named COL.coords, from the COL.x, COL.y columns of the compact event schema"""
+    coords = list(zip(df[C.COL.x].tolist(), df[C.COL.y].tolist()))
+    return pd.Series(coords, index=df.index, name=C.COL.coords, dtype=object)
+
+
 def hot_spot_cls(data, kind='mean', spu=None, to_int=True):
     """
 
-    :param data:
+    :param data: np.ndarray of counts, dict of data (see event_cnt) or pd.DataFrame of counts
     :param kind: str
         mean, mean+std, median: True if data>mean/mean+std/median;
         float: True if data is within the top float percentile.
@@ -100,8 +203,9 @@ def hot_spot_cls(data, kind='mean', spu=None, to_int=True):
                 hot_spot = (data > np.median(data))
             else:
                 raise ValueError('hotspot cls: kind=%s is not supported' % kind)
-    elif isinstance(data, dict):
-        cnts = event_cnt(data, spu=spu)
+    elif isinstance(data, (dict, pd.DataFrame)):
+        # DataFrame: counts already computed, index=spu index, columns=dnames
+        cnts = event_cnt(data, spu=spu) if isinstance(data, dict) else data.copy()
         for i in range(cnts.shape[1]):
             cnts.iloc[:, i] = hot_spot_cls(cnts.iloc[:, i].values, kind=kind, spu=spu, to_int=to_int)
         hot_spot = cnts